@@ -0,0 +1,319 @@
+"""
+Script: Micro-benchmarks de las geocercas del pipeline
+
+Descripción: Mide la lógica de geocercas de pipeline.py sin Beam ni bases de datos. Cubre TransformacionPubSub,
+el indexado de zonas de LeerZonasPostgres y ZonasRestringidas.process, variando las zonas por menor, las zonas
+totales, el tamaño de lote y el núcleo de distancia. Para cada caso registra operaciones por segundo y memoria pico
+por lote, y para cada núcleo el número de clasificaciones que difieren de la geodésica.
+
+El script termina con código 1 si algún núcleo clasifica alguna ubicación de forma distinta a la geodésica; esa
+comprobación es determinista y es la que bloquea el despliegue en el workflow.
+
+Con --guardar se escribe una línea base en JSON y con --comparar se informa de los casos más lentos o con más memoria
+que en ella. Las ops/s dependen de la máquina, de la versión de Python y de la carga del momento, así que la
+comparación solo avisa; con --estricto también termina con código 1, para usarla en la máquina que grabó la línea base:
+
+    python benchmark_geocercas.py --comparar linea_base_geocercas.json --estricto
+
+Tras un cambio de rendimiento intencionado se regenera con los parámetros por defecto y --guardar
+linea_base_geocercas.json.
+
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from geopy.distance import geodesic
+
+from pipeline import NUCLEOS_DISTANCIA, LeerZonasPostgres, TransformacionPubSub, ZonasRestringidas
+
+
+def lista_enteros(texto):
+    return [int(valor) for valor in texto.split(',')]
+
+
+# Latitudes de las zonas con las que se miden los errores de clasificación; el error de los núcleos crece hacia los polos
+LATITUDES_ERROR = (39.47, 60.0, 70.0, 80.0)
+
+
+def generar_filas_zonas(rnd, menores, zonas_por_menor, centro=(39.47, -0.376)):
+    """Filas como las de la consulta de LeerZonasPostgres, con las zonas de cada menor repartidas por la ciudad."""
+    filas = []
+    for i in range(menores):
+        for _ in range(zonas_por_menor):
+            radio_peligro = rnd.randint(50, 200)
+            filas.append((
+                f"menor-{i}", f"Menor {i}", "Zona",
+                centro[0] + rnd.uniform(-0.045, 0.045),
+                centro[1] + rnd.uniform(-0.045, 0.045),
+                radio_peligro,
+                radio_peligro + rnd.randint(20, 100)
+            ))
+    return filas
+
+
+def generar_ubicaciones(rnd, menores, cantidad):
+    """Ubicaciones consecutivas de menores que caminan, cada una un segundo después de la anterior del mismo menor."""
+    inicio = datetime(2026, 1, 1, 8, 0, 0)
+    posiciones = [[39.47 + rnd.uniform(-0.045, 0.045), -0.376 + rnd.uniform(-0.045, 0.045)] for _ in range(menores)]
+    ubicaciones = []
+    for n in range(cantidad):
+        i = n % menores
+        posiciones[i][0] += rnd.uniform(-1, 1) * 1.4 / 111320
+        posiciones[i][1] += rnd.uniform(-1, 1) * 1.4 / 85000
+        ubicaciones.append({
+            "id_menor": f"menor-{i}",
+            "timestamp": (inicio + timedelta(seconds=n // menores)).isoformat(),
+            "latitud": posiciones[i][0],
+            "longitud": posiciones[i][1]
+        })
+    return ubicaciones
+
+
+def medir(funcion, operaciones, repeticiones):
+    """Ejecuta funcion() repeticiones veces; devuelve las operaciones por segundo de la más rápida y la memoria pico por lote."""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+
+    # La memoria se mide en una ejecución aparte porque tracemalloc ralentiza la ejecución
+    tracemalloc.start()
+    funcion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # La ejecución más rápida es la menos afectada por otros procesos de la máquina
+    return {"ops_s": operaciones / min(tiempos), "bytes_pico": pico}
+
+
+def casos_transformacion(args):
+    rnd = random.Random(args.semilla)
+    for tamano_lote in args.tamano_lote:
+        mensajes = [json.dumps(ubicacion).encode('utf-8') for ubicacion in generar_ubicaciones(rnd, 100, tamano_lote)]
+        yield f"TransformacionPubSub lote={tamano_lote}", lambda: [TransformacionPubSub(m) for m in mensajes], tamano_lote
+
+
+def casos_indexado(args):
+    rnd = random.Random(args.semilla)
+    for menores in args.menores:
+        for zonas_por_menor in args.zonas_por_menor:
+            filas = generar_filas_zonas(rnd, menores, zonas_por_menor)
+            yield (f"LeerZonasPostgres.indexar_zonas zonas={len(filas)}",
+                   lambda filas=filas: LeerZonasPostgres.indexar_zonas(filas), len(filas))
+
+
+def casos_evaluacion(args):
+    for menores in args.menores:
+        for zonas_por_menor in args.zonas_por_menor:
+            rnd = random.Random(args.semilla)
+            _, zonas, versiones = LeerZonasPostgres.indexar_zonas(generar_filas_zonas(rnd, menores, zonas_por_menor))
+
+            for tamano_lote in args.tamano_lote:
+                elementos = [
+                    dict(ubicacion, lista_zonas=zonas[ubicacion['id_menor']], version_zonas=versiones[ubicacion['id_menor']])
+                    for ubicacion in generar_ubicaciones(rnd, menores, tamano_lote)
+                ]
+
+                for nucleo in args.nucleos:
+                    for velocidad in args.velocidades:
+                        def lote(nucleo=nucleo, velocidad=velocidad, elementos=elementos):
+                            # Un DoFn nuevo por lote, como un paquete que llega a un trabajador sin estado previo
+                            dofn = ZonasRestringidas(velocidad_maxima=velocidad, nucleo_distancia=nucleo)
+                            for elemento in elementos:
+                                for _ in dofn.process(dict(elemento)):
+                                    pass
+
+                        saltos = f"velocidad={velocidad:g}" if velocidad > 0 else "sin_saltos"
+                        nombre = (f"ZonasRestringidas menores={menores} zonas_por_menor={zonas_por_menor} "
+                                  f"lote={tamano_lote} nucleo={nucleo} {saltos}")
+                        yield nombre, lote, tamano_lote
+
+
+def errores_clasificacion(args):
+    """Clasificaciones que difieren de la geodésica para puntos a menos de 5 cm de algún radio, en varias latitudes."""
+    rnd = random.Random(args.semilla)
+    elementos = []
+    for latitud in LATITUDES_ERROR:
+        elementos.extend(puntos_junto_a_radios(rnd, latitud, args.puntos_error // len(LATITUDES_ERROR)))
+
+    def clasificar(nucleo):
+        dofn = ZonasRestringidas(velocidad_maxima=0.0, nucleo_distancia=nucleo)
+        return [next(dofn.process(dict(elemento)))['estado'] for elemento in elementos]
+
+    referencia = clasificar('geodesica')
+    return {
+        nucleo: sum(a != b for a, b in zip(clasificar(nucleo), referencia))
+        for nucleo in args.nucleos if nucleo != 'geodesica'
+    }
+
+
+def puntos_junto_a_radios(rnd, latitud, cantidad):
+    """Ubicaciones a menos de 5 cm, medidos sobre el elipsoide, de uno de los radios de una zona de entre 50 m y 50 km."""
+    elementos = []
+    for _ in range(cantidad):
+        radio_peligro = math.exp(rnd.uniform(math.log(50), math.log(50000)))
+        zona = {
+            'id_menor': "menor-0",
+            'nombre_menor': "Menor 0",
+            'nombre_zona': "Zona",
+            'latitud': latitud + rnd.uniform(-0.045, 0.045),
+            'longitud': rnd.uniform(-0.045, 0.045),
+            'radio_peligro': radio_peligro,
+            'radio_advertencia': radio_peligro * rnd.uniform(1.1, 1.5)
+        }
+        radio = rnd.choice([zona['radio_peligro'], zona['radio_advertencia']]) + rnd.uniform(-0.05, 0.05)
+        punto = geodesic(meters=radio).destination((zona['latitud'], zona['longitud']), rnd.uniform(0, 360))
+        elementos.append({
+            "id_menor": "menor-0",
+            "latitud": punto.latitude,
+            "longitud": punto.longitude,
+            "lista_zonas": [zona],
+            "version_zonas": None
+        })
+    return elementos
+
+
+def comparar(resultados, linea_base, umbral_velocidad, umbral_memoria, holgura_memoria):
+    regresiones = []
+    for nombre, resultado in resultados.items():
+        base = linea_base.get("casos", {}).get(nombre)
+        if base is None:
+            continue
+        if resultado["ops_s"] < base["ops_s"] * (1 - umbral_velocidad):
+            regresiones.append(f"{nombre}: {resultado['ops_s']:,.0f} ops/s frente a {base['ops_s']:,.0f} en la línea base")
+        # Con picos de pocos KiB el ruido del asignador supera cualquier umbral relativo
+        if resultado["bytes_pico"] > max(base["bytes_pico"] * (1 + umbral_memoria), base["bytes_pico"] + holgura_memoria):
+            regresiones.append(f"{nombre}: {resultado['bytes_pico']:,} bytes pico frente a {base['bytes_pico']:,} en la línea base")
+    return regresiones
+
+
+def main(args):
+    resultados = {}
+    errores = {}
+    casos = list(casos_transformacion(args)) + list(casos_indexado(args)) + list(casos_evaluacion(args))
+    if args.filtro:
+        casos = [caso for caso in casos if args.filtro in caso[0]]
+
+    for nombre, funcion, operaciones in casos:
+        resultados[nombre] = medir(funcion, operaciones, args.repeticiones)
+        print(f"{nombre:<100} {resultados[nombre]['ops_s']:>14,.0f} ops/s {resultados[nombre]['bytes_pico'] / 1024:>10,.0f} KiB")
+
+    if args.puntos_error:
+        errores = errores_clasificacion(args)
+        for nucleo, distintas in errores.items():
+            print(f"Núcleo {nucleo}: {distintas}/{args.puntos_error} clasificaciones distintas de la geodésica junto a los radios")
+
+    if args.guardar:
+        with open(args.guardar, 'w') as f:
+            json.dump({
+                "fecha": datetime.now().isoformat(),
+                "python": sys.version.split()[0],
+                "casos": resultados,
+                "errores_clasificacion": errores
+            }, f, indent=2, ensure_ascii=False)
+        print(f"Línea base guardada en {args.guardar}")
+
+    if args.comparar:
+        with open(args.comparar) as f:
+            linea_base = json.load(f)
+        regresiones = comparar(resultados, linea_base, args.umbral_velocidad, args.umbral_memoria, args.holgura_memoria)
+        if regresiones:
+            print(f"\nREGRESIONES respecto a la línea base (grabada con Python {linea_base.get('python', '?')}):")
+            for regresion in regresiones:
+                print(f"  - {regresion}")
+        else:
+            print(f"Sin regresiones respecto a {args.comparar}")
+
+    # Un núcleo rápido nunca debe clasificar distinto que la geodésica, haya o no línea base
+    if any(errores.values()):
+        print("\nERROR: algún núcleo clasifica ubicaciones de forma distinta a la geodésica")
+        sys.exit(1)
+
+    if args.comparar and args.estricto and regresiones:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=('Micro-benchmarks de las geocercas del pipeline.'))
+
+    parser.add_argument(
+                '--menores',
+                type=lista_enteros,
+                default=[100],
+                help='Menores distintos, separados por comas (zonas totales = menores x zonas por menor).')
+    parser.add_argument(
+                '--zonas_por_menor',
+                type=lista_enteros,
+                default=[1, 5, 20],
+                help='Zonas por menor, separadas por comas.')
+    parser.add_argument(
+                '--tamano_lote',
+                type=lista_enteros,
+                default=[500],
+                help='Ubicaciones por lote, separadas por comas.')
+    parser.add_argument(
+                '--nucleos',
+                type=lambda texto: texto.split(','),
+                default=list(NUCLEOS_DISTANCIA),
+                help='Núcleos de distancia, separados por comas.')
+    parser.add_argument(
+                '--velocidades',
+                type=lambda texto: [float(valor) for valor in texto.split(',')],
+                default=[0.0, 40.0],
+                help='Velocidades máximas en m/s, separadas por comas; 0 evalúa todas las ubicaciones (caso de referencia sin saltos).')
+    parser.add_argument(
+                '--repeticiones',
+                type=int,
+                default=5,
+                help='Repeticiones por caso; se usa la más rápida.')
+    parser.add_argument(
+                '--puntos_error',
+                type=int,
+                default=2000,
+                help='Puntos junto a los radios para medir errores de clasificación (0 = no medir).')
+    parser.add_argument(
+                '--semilla',
+                type=int,
+                default=1234,
+                help='Semilla de los datos sintéticos.')
+    parser.add_argument(
+                '--filtro',
+                default=None,
+                help='Ejecutar solo los casos cuyo nombre contenga este texto.')
+    parser.add_argument(
+                '--guardar',
+                default=None,
+                help='Fichero JSON donde guardar los resultados como línea base.')
+    parser.add_argument(
+                '--comparar',
+                default=None,
+                help='Línea base JSON con la que comparar; solo informa de las regresiones salvo con --estricto.')
+    parser.add_argument(
+                '--estricto',
+                action='store_true',
+                help='Terminar con código 1 si hay regresiones de velocidad o memoria respecto a --comparar.')
+    parser.add_argument(
+                '--umbral_velocidad',
+                type=float,
+                default=0.2,
+                help='Pérdida de ops/s tolerada respecto a la línea base (0.2 = 20%%).')
+    parser.add_argument(
+                '--umbral_memoria',
+                type=float,
+                default=0.2,
+                help='Aumento de memoria pico tolerado respecto a la línea base (0.2 = 20%%).')
+    parser.add_argument(
+                '--holgura_memoria',
+                type=int,
+                default=64 * 1024,
+                help='Aumento de memoria pico en bytes que nunca se considera regresión.')
+
+    main(parser.parse_args())
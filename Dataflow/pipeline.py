@@ -7,18 +7,108 @@ se le enviará una notificación al padre.
 
 """
 import apache_beam as beam
+from apache_beam.metrics import Metrics
 from apache_beam.options.pipeline_options import PipelineOptions
 from apache_beam.transforms import combiners
 import argparse
+import hashlib
 import logging
 import json
 from geopy.distance import geodesic
 from datetime import datetime
 from google.cloud import firestore
 import psycopg2
+import math
 import time
 from zoneinfo import ZoneInfo
 
+# Elipsoide WGS84, el mismo que usa geodesic
+SEMIEJE_MAYOR_WGS84 = 6378137.0
+EXCENTRICIDAD2_WGS84 = (1 / 298.257223563) * (2 - 1 / 298.257223563)
+RADIO_MEDIO_TIERRA = 6371008.8
+
+def distancia_equirectangular(lat1, lon1, lat2, lon2):
+    """Aproximación plana con los radios de curvatura del elipsoide en la latitud media; error de milímetros a pocos km."""
+    latitud_media = math.radians((lat1 + lat2) / 2)
+    seno = math.sin(latitud_media)
+    w = 1 - EXCENTRICIDAD2_WGS84 * seno * seno
+    radio_meridiano = SEMIEJE_MAYOR_WGS84 * (1 - EXCENTRICIDAD2_WGS84) / (w * math.sqrt(w))
+    radio_primer_vertical = SEMIEJE_MAYOR_WGS84 / math.sqrt(w)
+    # Diferencia de longitud en [-180, 180) para los puntos a ambos lados del antimeridiano
+    delta_longitud = (lon2 - lon1 + 180) % 360 - 180
+    return math.hypot(
+        math.radians(lat2 - lat1) * radio_meridiano,
+        math.radians(delta_longitud) * radio_primer_vertical * math.cos(latitud_media)
+    )
+
+def distancia_haversine(lat1, lon1, lat2, lon2):
+    """Distancia de círculo máximo sobre una esfera de radio medio; error relativo de hasta ~0,5%."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    h = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_MEDIO_TIERRA * math.asin(math.sqrt(h))
+
+def distancia_geodesica(lat1, lon1, lat2, lon2):
+    """Distancia sobre el elipsoide WGS84 (Karney), exacta pero lenta."""
+    return geodesic((lat1, lon1), (lat2, lon2)).meters
+
+def error_equirectangular(metros, latitud):
+    # Medido frente a geodesic entre 0 y 85º, con margen x2: crece con el cuadrado de la distancia y con la
+    # tangente de la latitud (3e-6 a 50 km en España, 2,5e-5 a 70º, 6e-4 a 85º)
+    tangente = math.tan(math.radians(min(abs(latitud), 89.9)))
+    # El suelo de 1e-9 cubre el redondeo en distancias cortas
+    return max(1e-9, 2e-2 * (metros / RADIO_MEDIO_TIERRA) ** 2 * (1 + 8 * tangente * tangente))
+
+def error_haversine(metros, latitud):
+    return 6e-3
+
+def error_geodesica(metros, latitud):
+    return 0.0
+
+# Núcleo de distancia y cota de su error relativo frente a la geodésica en función de la distancia y la latitud
+NUCLEOS_DISTANCIA = {
+    'equirectangular': (distancia_equirectangular, error_equirectangular),
+    'haversine': (distancia_haversine, error_haversine),
+    'geodesica': (distancia_geodesica, error_geodesica)
+}
+
+# Instantes que acompañan a cada ubicación (campos t_<etapa>, en segundos Unix), en el orden del recorrido
+ETAPAS_TRAZA = ('ingesta', 'publicacion', 'cierre_ventana', 'evaluacion', 'escritura')
+
+# Límites superiores en ms de los contadores que forman el histograma de cada tramo
+LIMITES_HISTOGRAMA_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000, 30000, 60000)
+
+metricas_latencia = {}
+
+def registrar_latencia(tramo, segundos):
+    """Añade una latencia a la distribución del tramo y al contador de su intervalo del histograma."""
+    # Los relojes de la API, Pub/Sub y los trabajadores no están sincronizados; un desfase no da latencias negativas
+    milisegundos = max(0, int(segundos * 1000))
+    limite = next((l for l in LIMITES_HISTOGRAMA_MS if milisegundos <= l), None)
+    intervalo = f"hasta_{limite}" if limite is not None else f"mas_de_{LIMITES_HISTOGRAMA_MS[-1]}"
+
+    for nombre, crear in ((f"{tramo}_ms", Metrics.distribution), (f"{tramo}_ms_{intervalo}", Metrics.counter)):
+        if nombre not in metricas_latencia:
+            metricas_latencia[nombre] = crear('latencia', nombre)
+    metricas_latencia[f"{tramo}_ms"].update(milisegundos)
+    metricas_latencia[f"{tramo}_ms_{intervalo}"].inc()
+
+def marcar_etapa(element, etapa, instante=None):
+    """Guarda en el elemento el instante de una etapa y registra la latencia desde la etapa anterior trazada."""
+    instante = time.time() if instante is None else instante
+    element[f"t_{etapa}"] = instante
+
+    anteriores = [e for e in ETAPAS_TRAZA[:ETAPAS_TRAZA.index(etapa)] if element.get(f"t_{e}") is not None]
+    if anteriores:
+        registrar_latencia(f"{anteriores[-1]}_a_{etapa}", instante - element[f"t_{anteriores[-1]}"])
+    if etapa == ETAPAS_TRAZA[-1] and anteriores:
+        registrar_latencia("extremo_a_extremo", instante - element[f"t_{anteriores[0]}"])
+    return element
+
+def trazas(element):
+    """Instantes de todas las etapas, None en las no trazadas (merge=True de Firestore no borraría las antiguas)."""
+    return {etapa: element.get(f"t_{etapa}") for etapa in ETAPAS_TRAZA}
+
 def TransformacionPubSub(message):
     """Función para transformar los mensajes de Pub/Sub a un formato adecuado para el procesamiento, si falla devuelve None para no romper el proceso."""
     try:    
@@ -33,6 +123,18 @@ def TransformacionPubSub(message):
         return None
 
 
+class MarcarPublicacion(beam.DoFn):
+    """Traza el instante de publicación en Pub/Sub, que ReadFromPubSub asigna como timestamp del elemento."""
+    def process(self, element, timestamp=beam.DoFn.TimestampParam):
+        yield marcar_etapa(dict(element), 'publicacion', timestamp.micros / 1e6)
+
+
+class MarcarCierreVentana(beam.DoFn):
+    """Traza el instante en que la ventana se cierra y su última ubicación sigue el flujo."""
+    def process(self, element):
+        yield marcar_etapa(dict(element), 'cierre_ventana')
+
+
 class LeerZonasPostgres(beam.DoFn):
     """Se conecta a PostgreSQL y extrae las zonas restringidas, actualiza las zonas cada 5 min."""
     def __init__(self, host, db, user, password):
@@ -41,6 +143,8 @@ class LeerZonasPostgres(beam.DoFn):
         self.user = user
         self.password = password
         self.lista_zonas = [] 
+        self.zonas_por_menor = {}
+        self.versiones_zonas = {}
         self.ultima_actualizacion = 0  
         self.tiempo_refresco = 300
 
@@ -49,6 +153,34 @@ class LeerZonasPostgres(beam.DoFn):
             host=self.host, database=self.db, user=self.user, password=self.password
         )
 
+    @staticmethod
+    def indexar_zonas(filas):
+        """Convierte las filas de la consulta en zonas y las indexa por menor, con una versión de las zonas de cada uno."""
+        nuevas_zonas = []
+        for fila in filas:
+            zona_dict = {
+                'id_menor': fila[0],
+                'nombre_menor': fila[1], 
+                'nombre_zona': fila[2],  
+                'latitud': float(fila[3]),
+                'longitud': float(fila[4]),
+                'radio_peligro': float(fila[5]),
+                'radio_advertencia': float(fila[6])
+            }
+            nuevas_zonas.append(zona_dict)
+        
+        # Zonas indexadas por menor, cada elemento solo lleva las suyas
+        zonas_por_menor = {}
+        for zona in nuevas_zonas:
+            zonas_por_menor.setdefault(zona['id_menor'], []).append(zona)
+
+        # La versión de las zonas de cada menor cambia solo si cambian sus zonas
+        versiones = {
+            id_menor: hashlib.md5(repr(sorted(sorted(zona.items()) for zona in zonas)).encode('utf-8')).hexdigest()
+            for id_menor, zonas in zonas_por_menor.items()
+        }
+        return nuevas_zonas, zonas_por_menor, versiones
+
     def process (self, element):
         tiempo_actual = time.time()
         if (tiempo_actual - self.ultima_actualizacion) > self.tiempo_refresco or not self.lista_zonas:
@@ -69,20 +201,11 @@ class LeerZonasPostgres(beam.DoFn):
                 cursor.execute(query)                
                 filas = cursor.fetchall()
                 
-                nuevas_zonas = []
-                for fila in filas:
-                    zona_dict = {
-                        'id_menor': fila[0],
-                        'nombre_menor': fila[1], 
-                        'nombre_zona': fila[2],  
-                        'latitud': float(fila[3]),
-                        'longitud': float(fila[4]),
-                        'radio_peligro': float(fila[5]),
-                        'radio_advertencia': float(fila[6])
-                    }
-                    nuevas_zonas.append(zona_dict)
-                
+                nuevas_zonas, zonas_por_menor, versiones = self.indexar_zonas(filas)
+
                 self.lista_zonas = nuevas_zonas # Actualiza
+                self.zonas_por_menor = zonas_por_menor
+                self.versiones_zonas = versiones
                 self.ultima_actualizacion = time.time() # Reinicia el reloj
                 cursor.close()
                 logging.info("¡Zonas actualizadas desde la base de datos!")
@@ -92,7 +215,8 @@ class LeerZonasPostgres(beam.DoFn):
         
     
         elemento_actualizado = dict(element)
-        elemento_actualizado['lista_zonas'] = self.lista_zonas
+        elemento_actualizado['lista_zonas'] = self.zonas_por_menor.get(element.get('id_menor'), [])
+        elemento_actualizado['version_zonas'] = self.versiones_zonas.get(element.get('id_menor'))
         yield elemento_actualizado
 
     def teardown(self):
@@ -101,8 +225,57 @@ class LeerZonasPostgres(beam.DoFn):
 
 
 class ZonasRestringidas(beam.DoFn):
-    """Clase para comparar la ubicación del menor con las zonas restringidas establecidas por el padre"""
-   
+    """Clase para comparar la ubicación del menor con las zonas restringidas establecidas por el padre.
+
+    Guarda por menor la distancia al borde de advertencia más cercano en la última evaluación completa. Mientras el
+    menor no haya podido llegar a ese borde a la velocidad máxima, la ubicación se marca como OK sin recalcular
+    distancias. Si cambian las zonas del menor se evalúa de nuevo en el momento. Con velocidad_maxima 0 se evalúan
+    todas las ubicaciones.
+
+    Las distancias se calculan con el núcleo configurado; si una distancia cae a menos de la cota de error del núcleo
+    (más tolerancia_metros) de alguno de los radios, se recalcula con la geodésica para que la clasificación coincida."""
+
+    def __init__(self, velocidad_maxima=40.0, nucleo_distancia='equirectangular', tolerancia_metros=0.5):
+        self.velocidad_maxima = velocidad_maxima
+        self.nucleo_distancia = nucleo_distancia
+        self.tolerancia_metros = tolerancia_metros
+        self.distancia, self.error_relativo = NUCLEOS_DISTANCIA[nucleo_distancia]
+        self.ultima_evaluacion = {}
+
+    def distancia_a_zona(self, lat_menor, long_menor, lat_zona, long_zona, radio_peligro, radio_advertencia):
+        """Distancia a la zona y margen de error que queda tras el refinado."""
+        distancia_metros = self.distancia(lat_menor, long_menor, lat_zona, long_zona)
+        latitud = max(abs(lat_menor), abs(lat_zona))
+        banda = self.tolerancia_metros + self.error_relativo(distancia_metros, latitud) * distancia_metros
+
+        if banda > self.tolerancia_metros and (abs(distancia_metros - radio_peligro) <= banda or abs(distancia_metros - radio_advertencia) <= banda):
+            return distancia_geodesica(lat_menor, long_menor, lat_zona, long_zona), 0.0
+        return distancia_metros, banda
+
+    @staticmethod
+    def segundos_ubicacion(element):
+        """Instante de la ubicación según el dispositivo, en segundos; None si no se puede interpretar."""
+        try:
+            return datetime.fromisoformat(element['timestamp']).timestamp()
+        except Exception:
+            return None
+
+    def puede_saltarse(self, id_menor, version_zonas, segundos):
+        # Con velocidad_maxima 0 (o negativa) no se salta ninguna evaluación
+        if self.velocidad_maxima <= 0:
+            return False
+
+        evaluacion = self.ultima_evaluacion.get(id_menor)
+        if evaluacion is None or segundos is None:
+            return False
+
+        segundos_evaluacion, margen, version_evaluacion = evaluacion
+        if version_evaluacion != version_zonas:
+            return False
+
+        # El menor no puede haber recorrido más de velocidad_maxima * tiempo desde la última evaluación completa
+        return self.velocidad_maxima * abs(segundos - segundos_evaluacion) < margen
+
     def process(self, element):
         try:
             id_menor=element.get('id_menor')
@@ -119,25 +292,39 @@ class ZonasRestringidas(beam.DoFn):
         nombre_real = next((z.get('nombre_menor') for z in lista_zonas if z.get('id_menor') == id_actual), "el menor")
         element['nombre_menor'] = nombre_real
 
-
-        for zona in lista_zonas:
-            if id_menor == zona.get('id_menor'): 
-                element['nombre_menor'] = zona.get('nombre_menor')
-                lat_zona=float(zona.get('latitud'))
-                long_zona=float(zona.get('longitud'))
-                radio_peligro = float(zona.get('radio_peligro'))
-                radio_advertencia = float(zona.get('radio_advertencia'))
-
-                distancia_metros = geodesic((lat_menor, long_menor), (lat_zona, long_zona)).meters
-                if distancia_metros < radio_peligro:
-                    estado = "PELIGRO"
-                    break
-                
-                elif distancia_metros < radio_advertencia:
-                    if estado != "PELIGRO":
-                        estado = "ADVERTENCIA"
+        version_zonas = element.get('version_zonas')
+        segundos = self.segundos_ubicacion(element)
+
+        if not self.puede_saltarse(id_menor, version_zonas, segundos):
+            # Distancia mínima al borde de advertencia de cualquier zona; negativa si está dentro de alguna
+            margen = float('inf')
+
+            for zona in lista_zonas:
+                if id_menor == zona.get('id_menor'): 
+                    element['nombre_menor'] = zona.get('nombre_menor')
+                    lat_zona=float(zona.get('latitud'))
+                    long_zona=float(zona.get('longitud'))
+                    radio_peligro = float(zona.get('radio_peligro'))
+                    radio_advertencia = float(zona.get('radio_advertencia'))
+
+                    distancia_metros, banda = self.distancia_a_zona(lat_menor, long_menor, lat_zona, long_zona, radio_peligro, radio_advertencia)
+                    # Para saltarse evaluaciones se toma el margen más desfavorable dentro del error del núcleo
+                    margen = min(margen, distancia_metros - radio_advertencia - banda)
+                    if distancia_metros < radio_peligro:
+                        estado = "PELIGRO"
+                        break
+                    
+                    elif distancia_metros < radio_advertencia:
+                        if estado != "PELIGRO":
+                            estado = "ADVERTENCIA"
+                else:
+                    continue
+
+            if estado == "OK" and margen > 0 and segundos is not None:
+                self.ultima_evaluacion[id_menor] = (segundos, margen, version_zonas)
             else:
-                continue
+                self.ultima_evaluacion.pop(id_menor, None)
+
         element['estado'] = estado
 
         if 'fecha' not in element:
@@ -145,6 +332,8 @@ class ZonasRestringidas(beam.DoFn):
 
         if 'lista_zonas' in element:
             del element['lista_zonas']
+        element.pop('version_zonas', None)
+        marcar_etapa(element, 'evaluacion')
         
         logging.info(f"Procesado: Niño {id_menor} -> Estado: {estado}")        
 
@@ -195,10 +384,16 @@ class GuardarEnFirestore(beam.DoFn):
         self.db = firestore.Client(project=self.project_id)
 
     def process(self, element):
+        # El mismo elemento llega a las ramas de BigQuery, Postgres y notificaciones, así que no se modifica
+        element = dict(element)
         id_menor = element['id_menor']
         nombre_menor = element['nombre_menor']
         estado = element['estado']
 
+        # La escritura se traza al empezar para poder guardarla en los propios documentos
+        marcar_etapa(element, 'escritura')
+        inicio_escritura = time.time()
+
         # ubicacion
         doc_ref_ubic = self.db.collection('ubicaciones').document(id_menor)
         datos_ubicacion = {
@@ -207,7 +402,8 @@ class GuardarEnFirestore(beam.DoFn):
             "latitud": element['latitud'],
             "longitud": element['longitud'],
             "estado": estado,
-            "fecha": firestore.SERVER_TIMESTAMP 
+            "fecha": firestore.SERVER_TIMESTAMP,
+            "trazas": trazas(element)
         }
         doc_ref_ubic.set(datos_ubicacion, merge=True) #merge=true para que no borre datos anteriores como info del niño, solo actualiza la ubicacion y el estado.
         logging.info(f"Ubicación actualizada: {nombre_menor}")
@@ -226,13 +422,16 @@ class GuardarEnFirestore(beam.DoFn):
                 "nombre_menor": nombre_menor,
                 "asunto": f"¡ALERTA DE {estado}!",
                 "cuerpo": mensaje,
+                "estado": estado,
                 "fecha": firestore.SERVER_TIMESTAMP,
+                "trazas": trazas(element),
                 "leido": False
             }
             doc_ref_alerta = self.db.collection('notificaciones').add(datos_alerta)
 
             logging.info(f"Documento de notificación escrito en Firestore: {doc_ref_alerta[1].id}")
 
+        registrar_latencia("escritura_firestore", time.time() - inicio_escritura)
         yield element
 
 class GuardarAlertasPostgres(beam.DoFn):
@@ -284,6 +483,12 @@ class GuardarAlertasPostgres(beam.DoFn):
 
 """ Codigo: Proceso de Dataflow  """
 
+def velocidad_no_negativa(texto):
+    velocidad = float(texto)
+    if velocidad < 0:
+        raise argparse.ArgumentTypeError(f"la velocidad no puede ser negativa: {texto}")
+    return velocidad
+
 def run():
 
     """ Argumentos de entrada para la ejecución del pipeline. """
@@ -317,6 +522,21 @@ def run():
                 '--db_pass', 
                 required=True, 
                 help='Contraseña de la BD.')
+    parser.add_argument(
+                '--velocidad_maxima_menor',
+                type=velocidad_no_negativa,
+                default=40.0,
+                help='Velocidad máxima plausible de un menor en m/s, para saltarse evaluaciones lejos de las zonas (0 = evaluar siempre).')
+    parser.add_argument(
+                '--nucleo_distancia',
+                choices=list(NUCLEOS_DISTANCIA),
+                default='equirectangular',
+                help='Cálculo de distancias: equirectangular (rápido), haversine o geodesica (exacto).')
+    parser.add_argument(
+                '--tolerancia_distancia_metros',
+                type=float,
+                default=0.5,
+                help='Metros alrededor de cada radio en los que se recalcula la distancia con la geodésica.')
 
     
     args, pipeline_opts = parser.parse_known_args()
@@ -338,17 +558,23 @@ def run():
                 | "LeerDeUbicacionPubSub" >> beam.io.ReadFromPubSub(subscription=f'projects/{args.project_id}/subscriptions/{args.ubicacion_pubsub_subscription_name}')
                 | "TransformarMensajePubSub">> beam.Map(TransformacionPubSub)
                 | "FiltrarVacios" >> beam.Filter(lambda x: x is not None) 
+                | "MarcarPublicacion" >> beam.ParDo(MarcarPublicacion())
                 | "VentanaDeTiempo" >> beam.WindowInto(beam.window.FixedWindows(10), allowed_lateness=beam.utils.timestamp.Duration(seconds=5)) # Agrupamos los datos en bloques de 10 segundos
                 | "MapearConClave" >> beam.Map(lambda x: (x.get('id_menor'), x)) # filtramos usando el id_menor
                 | "QuedarseConElUltimo" >> combiners.Latest.PerKey() #De todos los mensajes con mismo id en esos 10s, se queda solo con el más reciente
                 | "ExtraerValores" >> beam.FlatMap(lambda x: [x[1]] if x and x[1] is not None else [])#Le quitamos el filtro para que el diccionario vuelva a la normalidad y siga el flujo
+                | "MarcarCierreVentana" >> beam.ParDo(MarcarCierreVentana())
                 | "LeerZonasPostgres" >> beam.ParDo(LeerZonasPostgres(
                     host=args.db_host, 
                     db="menores_db", 
                     user=args.db_user, 
                     password=args.db_pass
                 ))
-                | "CompararConZonasRestringidas" >> beam.ParDo(ZonasRestringidas())   
+                | "CompararConZonasRestringidas" >> beam.ParDo(ZonasRestringidas(
+                    velocidad_maxima=args.velocidad_maxima_menor,
+                    nucleo_distancia=args.nucleo_distancia,
+                    tolerancia_metros=args.tolerancia_distancia_metros
+                ))   
         )
 
         (mensajes_procesados
@@ -1,122 +1,345 @@
 from faker import Faker 
-from datetime import datetime
-from diffusers import StableDiffusionPipeline
+from datetime import datetime, date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from requests.adapters import HTTPAdapter
+import hashlib
 import random
 import uuid
 import json
 import os
-import torch
 import requests
 import io
+import string
 import sys
+import threading
+import time
+import unicodedata
 
 bucket_fotos = os.getenv("BUCKET_FOTOS")
 url_api = os.getenv("URL_API")
 api_key = os.getenv("API_KEY")
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
-pipe = StableDiffusionPipeline.from_pretrained(
-    "runwayml/stable-diffusion-v1-5", 
-    torch_dtype=torch.float16 if device == "cuda" else torch.float32
-).to(device)
+# "modelo" genera los retratos con Stable Diffusion; "marcador" usa imágenes de relleno y no carga el modelo
+modo_fotos = os.getenv("MODO_FOTOS", "modelo")
+pasos_inferencia = int(os.getenv("PASOS_INFERENCIA", "25"))
+resolucion_fotos = int(os.getenv("RESOLUCION_FOTOS", "512"))
+tamano_lote_fotos = int(os.getenv("TAMANO_LOTE_FOTOS", "4"))
+# Retratos distintos por prompt; los menores con el mismo prompt y semilla reutilizan el retrato de la caché
+variantes_foto = int(os.getenv("VARIANTES_FOTO", "20"))
+directorio_cache_fotos = os.getenv("DIRECTORIO_CACHE_FOTOS", "cache_fotos")
+
+num_adultos = int(os.getenv("NUM_ADULTOS", "3"))
+num_menores = int(os.getenv("NUM_MENORES", "5"))
+# Registros por petición; más de 1 usa los endpoints /lote de la API
+tamano_lote_registro = int(os.getenv("TAMANO_LOTE_REGISTRO", "1"))
+# Registros que se generan de una vez con Faker antes de mandarlos
+tamano_bloque = int(os.getenv("TAMANO_BLOQUE", "10000"))
+max_peticiones_en_vuelo = int(os.getenv("MAX_PETICIONES_EN_VUELO", "16"))
+subir_fotos_menores = os.getenv("SUBIR_FOTOS", "true").lower() == "true"
+
+# Sesión compartida por todos los hilos para reutilizar conexiones (keep-alive)
+sesion = requests.Session()
+sesion.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max_peticiones_en_vuelo))
+sesion.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=max_peticiones_en_vuelo))
+
+pipe = None
+device = None
+pipe_lock = threading.Lock()
 
 ciudades = ["Barcelona", "Valencia", "Madrid"]
 
 fake = Faker('es_ES')
 
-def foto_menor(id_menor, sexo_prompt):
-    prompt = f"Professional portrait of a  {sexo_prompt}, realistic, 4k, soft lighting"
-    
-    imagen = pipe(prompt).images[0]
+def obtener_pipeline():
+    # El modelo solo se carga la primera vez que hace falta generar un retrato que no está en la caché
+    global pipe, device
+    with pipe_lock:
+        if pipe is None:
+            import torch
+            from diffusers import StableDiffusionPipeline
+
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            pipe = StableDiffusionPipeline.from_pretrained(
+                "runwayml/stable-diffusion-v1-5", 
+                torch_dtype=torch.float16 if device == "cuda" else torch.float32
+            ).to(device)
+            pipe.set_progress_bar_config(disable=True)
+            if device == "cpu":
+                pipe.enable_attention_slicing()
+        return pipe
+
+def prompt_foto(sexo_prompt):
+    return f"Professional portrait of a  {sexo_prompt}, realistic, 4k, soft lighting"
+
+def ruta_cache_foto(prompt, semilla):
+    # La clave incluye los parámetros que cambian la imagen, no solo el prompt y la semilla
+    clave = hashlib.sha256(f"{prompt}|{semilla}|{pasos_inferencia}|{resolucion_fotos}".encode("utf-8")).hexdigest()
+    return os.path.join(directorio_cache_fotos, f"{clave[:32]}.png")
 
+def foto_marcador(prompt, semilla):
+    color = hashlib.sha256(f"{prompt}|{semilla}".encode("utf-8")).digest()[:3]
     img_buffer = io.BytesIO()
+    Image.new("RGB", (resolucion_fotos, resolucion_fotos), tuple(color)).save(img_buffer, format="PNG")
+    return img_buffer.getvalue()
+
+def generar_lote_fotos(peticiones):
+    # Un único paso del pipeline para todo el lote, con un generador por imagen para que cada semilla sea reproducible
+    import torch
+
+    modelo = obtener_pipeline()
+    prompts = [prompt for prompt, _ in peticiones]
+    generadores = [torch.Generator(device="cpu").manual_seed(semilla) for _, semilla in peticiones]
+    imagenes = modelo(
+        prompts,
+        generator=generadores,
+        num_inference_steps=pasos_inferencia,
+        height=resolucion_fotos,
+        width=resolucion_fotos
+    ).images
+
+    fotos = []
+    for imagen in imagenes:
+        img_buffer = io.BytesIO()
+        imagen.save(img_buffer, format="PNG")
+        fotos.append(img_buffer.getvalue())
+    return fotos
+
+def generar_fotos(peticiones):
+    """Genera las fotos de una lista de (prompt, semilla) y las devuelve por lotes como (peticiones, fotos)."""
+    pendientes = []
+    for peticion in dict.fromkeys(peticiones):
+        if modo_fotos == "marcador":
+            yield [peticion], [foto_marcador(*peticion)]
+            continue
+
+        ruta = ruta_cache_foto(*peticion)
+        if os.path.exists(ruta):
+            with open(ruta, "rb") as f:
+                yield [peticion], [f.read()]
+        else:
+            pendientes.append(peticion)
+
+    for i in range(0, len(pendientes), tamano_lote_fotos):
+        lote = pendientes[i:i + tamano_lote_fotos]
+        fotos = generar_lote_fotos(lote)
 
-    imagen.save(img_buffer, format="PNG")
+        os.makedirs(directorio_cache_fotos, exist_ok=True)
+        for peticion, foto in zip(lote, fotos):
+            ruta = ruta_cache_foto(*peticion)
+            with open(f"{ruta}.tmp", "wb") as f:
+                f.write(foto)
+            os.replace(f"{ruta}.tmp", ruta)
 
-    img_buffer.seek(0)
+        print(f"Retratos generados: {min(i + tamano_lote_fotos, len(pendientes))}/{len(pendientes)}")
+        yield lote, fotos
 
+def subir_foto(id_menor, foto):
     parametros = {"id_menor": id_menor}
-    archivos = {"archivo": (f"{id_menor}.png", img_buffer, "image/png")}
+    archivos = {"archivo": (f"{id_menor}.png", io.BytesIO(foto), "image/png")}
     
     try:
-        requests.post(f"{url_api}/fotos_menores", params = parametros, files = archivos, headers={"X-API-Key": api_key})
-
-        print(f"Foto generada y subida con exito")
+        res = sesion.post(f"{url_api}/fotos_menores", params = parametros, files = archivos, headers={"X-API-Key": api_key})
+        if res.status_code >= 400:
+            print(f"Error subiendo foto ({res.status_code}): {res.text}")
+            return False
+        return True
     except Exception as e:
         print(f"Error subiendo foto: {e}")
+        return False
 
-def generar_adulto():
-    sexo = random.choice(['m', 'f'])
-    nombre = fake.first_name_male() if sexo == 'm' else fake.first_name_female()
-    apellido_paterno = fake.last_name()
-    apellido_materno = fake.last_name()
-
-    return {
-        "id": str(uuid.uuid4()),
-        "nombre": nombre,
-        "apellidos": f"{apellido_paterno} {apellido_materno}",
-        "telefono": fake.phone_number(),
-        "email": fake.email(),
-        "ciudad": random.choice(ciudades),
-        "clave": fake.password(length = 10)
-    }
-
-def generar_menor(id_adulto, apellidos, ciudad):
-    sexo = random.choice(['masculino', 'femenino'])
-    id_menor = str(uuid.uuid4())
-    
-    if sexo == 'masculino':
-        nombre = fake.first_name_male()
-        sexo_prompt = "boy"
-    else:
-        nombre = fake.first_name_female()
-        sexo_prompt = "girl"
-
-    menor = {
-        "id": id_menor,
-        "id_adulto": id_adulto,
-        "nombre": nombre,
-        "apellidos": apellidos,
-        "dni": fake.nif(),
-        "fecha_nacimiento": fake.date_of_birth(minimum_age=10, maximum_age=17).strftime("%Y-%m-%d"),
-        "direccion": f"{ciudad}, Spain",
-        "url_foto": f"https://storage.googleapis.com/{bucket_fotos}/{id_menor}.png",
-        "discapacidad": random.random() < 0.1
-    }
-    
-    return menor, sexo_prompt
+def registrar(ruta, registros, clave_lote):
+    # Un registro va al endpoint individual; varios van juntos al endpoint /lote
+    try:
+        if len(registros) == 1:
+            res = sesion.post(f"{url_api}/{ruta}", json=registros[0], headers={"X-API-Key": api_key})
+        else:
+            res = sesion.post(f"{url_api}/{ruta}/lote", json={clave_lote: registros}, headers={"X-API-Key": api_key})
+        if res.status_code == 201:
+            return True
+        print(f"Error al registrar {ruta} ({res.status_code}): {res.text}")
+    except Exception as e:
+        print(f"Error al registrar {ruta}: {e}")
+    return False
 
-if __name__ == "__main__":
-    adultos = 3
-    menores = 5
-    lista_adultos = []
-
-    for _ in range(adultos):
-        adulto = generar_adulto()
-        try:
-            res = requests.post(f"{url_api}/adultos", json=adulto, headers={"X-API-Key": api_key})
-            if res.status_code == 201:
-                lista_adultos.append(adulto)
-                print(f"Adulto registrado: {adulto['nombre']} {adulto['apellidos']}")
+class Progreso:
+    def __init__(self, etiqueta, total):
+        self.etiqueta = etiqueta
+        self.total = total
+        self.hechos = 0
+        self.errores = 0
+        self.inicio = time.monotonic()
+        self.ultimo_informe = self.inicio
+        self.lock = threading.Lock()
+
+    def sumar(self, cantidad, correcto):
+        with self.lock:
+            if correcto:
+                self.hechos += cantidad
             else:
-                print(f"Error al registrar adulto ({res.status_code}): {res.text}")
-        except Exception as e:
-            print(f"Error: {e}")
-
-    if not lista_adultos:
-        print("No se han podido registrar adultos. Abortando generación de menores.")
-        sys.exit(1)
-
-    for _ in range(menores):
-        tutor = random.choice(lista_adultos)
-        
-        datos_menor, sexo_prompt = generar_menor(tutor["id"], tutor["apellidos"], tutor["ciudad"])
-        
-        foto_menor(datos_menor["id"], sexo_prompt)
-        
-        try:
-            res = requests.post(f"{url_api}/menores", json=datos_menor, headers={"X-API-Key": api_key})
-            if res.status_code == 201:
-                print(f"Menor {datos_menor['nombre']} asignado a {tutor['nombre']}")
-        except Exception as e:
-            print(f"Error: {e}")
+                self.errores += cantidad
+            ahora = time.monotonic()
+            if ahora - self.ultimo_informe >= 5 or self.hechos + self.errores >= self.total:
+                self.ultimo_informe = ahora
+                self.informar()
+
+    def informar(self):
+        segundos = max(time.monotonic() - self.inicio, 1e-9)
+        print(f"{self.etiqueta}: {self.hechos}/{self.total} ({self.hechos / max(self.total, 1) * 100:.1f}%) | "
+              f"Errores: {self.errores} | {self.hechos / segundos:,.0f}/s")
+
+class PoolPeticiones:
+    # Pool de hilos con un máximo de peticiones encoladas, para no acumular cientos de miles de tareas en memoria
+    def __init__(self, max_en_vuelo):
+        self.executor = ThreadPoolExecutor(max_workers=max_en_vuelo)
+        self.huecos = threading.BoundedSemaphore(max_en_vuelo * 4)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.executor.shutdown(wait=True)
+
+    def enviar(self, funcion, *args):
+        self.huecos.acquire()
+        futuro = self.executor.submit(funcion, *args)
+        futuro.add_done_callback(lambda _: self.huecos.release())
+        return futuro
+
+def muestras_faker(funcion, cantidad=1000):
+    # Faker genera cada valor con Python puro; para cientos de miles de registros se muestrea de un conjunto precalculado
+    return sorted({funcion() for _ in range(cantidad)})
+
+nombres_masculinos = None
+nombres_femeninos = None
+apellidos_comunes = None
+dominios_email = None
+
+def preparar_muestras():
+    global nombres_masculinos, nombres_femeninos, apellidos_comunes, dominios_email
+    if nombres_masculinos is None:
+        nombres_masculinos = muestras_faker(fake.first_name_male)
+        nombres_femeninos = muestras_faker(fake.first_name_female)
+        apellidos_comunes = muestras_faker(fake.last_name)
+        dominios_email = muestras_faker(fake.free_email_domain, 50)
+
+def nuevo_uuid():
+    return str(uuid.UUID(int=random.getrandbits(128), version=4))
+
+def ascii_minusculas(texto):
+    return unicodedata.normalize("NFKD", texto).encode("ascii", "ignore").decode("ascii").lower().replace(" ", "")
+
+def generar_nif():
+    numero = random.randrange(100000000)
+    return f"{numero:08d}{'TRWAGMYFPDXBNJZSQVHLCKE'[numero % 23]}"
+
+def generar_adultos(cantidad):
+    preparar_muestras()
+    sexos = random.choices(['m', 'f'], k=cantidad)
+    ciudades_adultos = random.choices(ciudades, k=cantidad)
+    alfabeto_clave = string.ascii_letters + string.digits
+
+    adultos = []
+    for sexo, ciudad in zip(sexos, ciudades_adultos):
+        nombre = random.choice(nombres_masculinos if sexo == 'm' else nombres_femeninos)
+        apellido_paterno, apellido_materno = random.choices(apellidos_comunes, k=2)
+        telefono = random.randrange(600000000, 800000000)
+
+        adultos.append({
+            "id": nuevo_uuid(),
+            "nombre": nombre,
+            "apellidos": f"{apellido_paterno} {apellido_materno}",
+            "telefono": f"+34 {str(telefono)[:3]} {str(telefono)[3:6]} {str(telefono)[6:]}",
+            "email": f"{ascii_minusculas(nombre)}.{ascii_minusculas(apellido_paterno)}{random.randrange(1000)}@{random.choice(dominios_email)}",
+            "ciudad": ciudad,
+            "clave": "".join(random.choices(alfabeto_clave, k=10))
+        })
+    return adultos
+
+def generar_menores(tutores, cantidad):
+    preparar_muestras()
+    hoy = date.today()
+    sexos = random.choices(['masculino', 'femenino'], k=cantidad)
+
+    menores = []
+    for sexo, tutor in zip(sexos, random.choices(tutores, k=cantidad)):
+        id_menor = nuevo_uuid()
+
+        if sexo == 'masculino':
+            nombre = random.choice(nombres_masculinos)
+            sexo_prompt = "boy"
+        else:
+            nombre = random.choice(nombres_femeninos)
+            sexo_prompt = "girl"
+
+        # Entre 10 y 17 años, como fake.date_of_birth(minimum_age=10, maximum_age=17)
+        fecha_nacimiento = hoy - timedelta(days=random.randrange(10 * 365, 18 * 365))
+
+        menor = {
+            "id": id_menor,
+            "id_adulto": tutor["id"],
+            "nombre": nombre,
+            "apellidos": tutor["apellidos"],
+            "dni": generar_nif(),
+            "fecha_nacimiento": fecha_nacimiento.strftime("%Y-%m-%d"),
+            "direccion": f"{tutor['ciudad']}, Spain",
+            "url_foto": f"https://storage.googleapis.com/{bucket_fotos}/{id_menor}.png",
+            "discapacidad": random.random() < 0.1
+        }
+        menores.append((menor, sexo_prompt))
+    return menores
+
+def sembrar_adultos(pool, cantidad):
+    progreso = Progreso("Adultos registrados", cantidad)
+    lotes = []
+
+    for inicio in range(0, cantidad, tamano_bloque):
+        bloque = generar_adultos(min(tamano_bloque, cantidad - inicio))
+        for i in range(0, len(bloque), tamano_lote_registro):
+            lote = bloque[i:i + tamano_lote_registro]
+            futuro = pool.enviar(registrar, "adultos", lote, "adultos")
+            futuro.add_done_callback(lambda f, n=len(lote): progreso.sumar(n, f.result()))
+            lotes.append((lote, futuro))
+
+    # Solo los adultos registrados pueden ser tutores
+    return [adulto for lote, futuro in lotes if futuro.result() for adulto in lote]
+
+def sembrar_menores(pool, tutores, cantidad):
+    progreso = Progreso("Menores registrados", cantidad)
+    menores_por_peticion = {}
+
+    for inicio in range(0, cantidad, tamano_bloque):
+        bloque = generar_menores(tutores, min(tamano_bloque, cantidad - inicio))
+        for i in range(0, len(bloque), tamano_lote_registro):
+            lote = [menor for menor, _ in bloque[i:i + tamano_lote_registro]]
+            futuro = pool.enviar(registrar, "menores", lote, "menores")
+            futuro.add_done_callback(lambda f, n=len(lote): progreso.sumar(n, f.result()))
+
+        # De cada menor solo se guarda el id hasta que su retrato esté listo
+        for menor, sexo_prompt in bloque:
+            peticion = (prompt_foto(sexo_prompt), random.randrange(variantes_foto))
+            menores_por_peticion.setdefault(peticion, []).append(menor["id"])
+
+    return menores_por_peticion
+
+def subir_fotos(pool, menores_por_peticion):
+    # Los retratos se generan por lotes mientras el pool sigue registrando menores y subiendo los lotes anteriores
+    progreso = Progreso("Fotos subidas", sum(len(ids) for ids in menores_por_peticion.values()))
+
+    for lote, fotos in generar_fotos(list(menores_por_peticion)):
+        for peticion, foto in zip(lote, fotos):
+            for id_menor in menores_por_peticion[peticion]:
+                futuro = pool.enviar(subir_foto, id_menor, foto)
+                futuro.add_done_callback(lambda f: progreso.sumar(1, f.result()))
+
+if __name__ == "__main__":
+    with PoolPeticiones(max_peticiones_en_vuelo) as pool:
+        lista_adultos = sembrar_adultos(pool, num_adultos)
+
+        if not lista_adultos:
+            print("No se han podido registrar adultos. Abortando generación de menores.")
+            sys.exit(1)
+
+        menores_por_peticion = sembrar_menores(pool, lista_adultos, num_menores)
+        if subir_fotos_menores:
+            subir_fotos(pool, menores_por_peticion)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Async Location Sender
+Sends generated positions to the ingest API over a shared, pooled HTTP client.
+"""
+
+import asyncio
+import random
+import time
+
+import httpx
+
+
+class AsyncLocationSender:
+    """
+    Asynchronous client for the /ubicaciones endpoints.
+
+    All requests share one httpx connection pool with keep-alive, at most
+    max_in_flight requests run at once, and failed requests (network errors,
+    429 and 5xx) are retried with exponential backoff and jitter. With
+    batch_size > 1, positions are grouped and sent to /ubicaciones/lote.
+
+    Use it as an async context manager:
+
+        async with AsyncLocationSender(url_api, api_key) as sender:
+            await sender.send_many(positions)
+    """
+
+    def __init__(self, url_api, api_key, max_in_flight=100, batch_size=1,
+                 max_retries=3, backoff_seconds=0.5, timeout=10.0):
+        """
+        Initialize the sender.
+
+        Args:
+            url_api: Base URL of the ingest API
+            api_key: Value of the X-API-Key header
+            max_in_flight: Maximum concurrent requests (also the connection pool size)
+            batch_size: Positions per request; 1 uses the single-position endpoint
+            max_retries: Retries per request after the first attempt
+            backoff_seconds: Base delay of the exponential backoff
+            timeout: Request timeout in seconds
+        """
+        self.url_api = url_api
+        self.api_key = api_key
+        self.max_in_flight = max_in_flight
+        self.batch_size = max(1, batch_size)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+
+        self.client = None
+        self._semaphore = None
+        self._buffer = []
+
+        # Counters in positions (not requests), and per-request latencies in seconds
+        self.sent = 0
+        self.errors = 0
+        self.latencies = []
+
+    async def __aenter__(self):
+        self.client = httpx.AsyncClient(
+            base_url=self.url_api,
+            headers={"X-API-Key": self.api_key},
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_in_flight, max_keepalive_connections=self.max_in_flight)
+        )
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.flush()
+        await self.client.aclose()
+
+    @staticmethod
+    def to_payload(position):
+        """Body of /ubicaciones for a position dictionary as produced by the generators."""
+        return {
+            "id_menor": str(position['user_id']),
+            "timestamp": position['timestamp'],
+            "latitud": float(position['latitude']),
+            "longitud": float(position['longitude'])
+        }
+
+    async def _post(self, path, body, count):
+        """POST with retries; count is the number of positions carried by the request."""
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                start = time.perf_counter()
+                try:
+                    response = await self.client.post(path, json=body)
+                    if response.status_code < 400:
+                        self.latencies.append(time.perf_counter() - start)
+                        self.sent += count
+                        return True
+                    retryable = response.status_code == 429 or response.status_code >= 500
+                    error = f"{response.status_code} - {response.text}"
+                except httpx.HTTPError as e:
+                    retryable = True
+                    error = str(e)
+
+                if not retryable or attempt == self.max_retries:
+                    print(f"Error enviando ubicacion: {error}")
+                    self.errors += count
+                    return False
+
+                await asyncio.sleep(self.backoff_seconds * (2 ** attempt) * (0.5 + random.random()))
+
+    async def send(self, position):
+        """Send one position, or add it to the current batch."""
+        if self.batch_size == 1:
+            return await self._post("/ubicaciones", self.to_payload(position), 1)
+
+        self._buffer.append(self.to_payload(position))
+        if len(self._buffer) >= self.batch_size:
+            await self.flush()
+
+    async def send_many(self, positions):
+        """Send many positions concurrently, in batches of batch_size when batching is enabled."""
+        payloads = [self.to_payload(position) for position in positions]
+
+        if self.batch_size == 1:
+            requests = [self._post("/ubicaciones", payload, 1) for payload in payloads]
+        else:
+            requests = [
+                self._post("/ubicaciones/lote", {"ubicaciones": payloads[i:i + self.batch_size]}, len(payloads[i:i + self.batch_size]))
+                for i in range(0, len(payloads), self.batch_size)
+            ]
+
+        await asyncio.gather(*requests)
+
+    async def flush(self):
+        """Send the positions waiting in the current batch."""
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        await self._post("/ubicaciones/lote", {"ubicaciones": batch}, len(batch))
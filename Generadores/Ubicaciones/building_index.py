@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Public Building Index
+Nearest public building lookups against a local, prefetched KD-tree.
+"""
+
+import os
+import pickle
+import re
+import threading
+import weakref
+
+import numpy as np
+import osmnx as ox
+from pyproj import Transformer
+from scipy.spatial import cKDTree
+
+
+# Generic/residential building types that are not considered points of interest
+EXCLUDED_BUILDING_TYPES = ['yes', 'apartments', 'house', 'residential']
+
+# UTM zone 30N, used for Spain (EPSG:32630)
+PROJECTED_CRS = 32630
+
+
+def _clean(value):
+    """First element of list values, as a CSV-safe string."""
+    if isinstance(value, list):
+        value = value[0] if value else ''
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        value = ''
+    return str(value).replace(',', ';').replace('\n', ' ')
+
+
+class BuildingIndex:
+    """
+    Public buildings of a whole street network area, projected once and held in a KD-tree.
+
+    Points are projected with a shared pyproj Transformer and matched against the
+    projected building centroids, so a lookup is a local tree query with no
+    network access and no GeoPandas reprojection.
+    """
+
+    def __init__(self, x, y, names, types, max_distance=50):
+        """
+        Build the index from projected centroids.
+
+        Args:
+            x: Projected X coordinate of each building centroid
+            y: Projected Y coordinate of each building centroid
+            names: Cleaned name of each building
+            types: Cleaned building type of each building
+            max_distance: Maximum distance in meters for a building to count as nearby
+        """
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.names = np.asarray(names, dtype=object)
+        self.types = np.asarray(types, dtype=object)
+        self.max_distance = max_distance
+        self.tree = cKDTree(np.column_stack([self.x, self.y])) if len(self.x) else None
+        self.transformer = Transformer.from_crs(4326, PROJECTED_CRS, always_xy=True)
+
+    @classmethod
+    def from_graph(cls, graph, max_distance=50):
+        """Download the buildings inside the bounding box of a street graph and index the public ones."""
+        lats = [data['y'] for _, data in graph.nodes(data=True)]
+        lons = [data['x'] for _, data in graph.nodes(data=True)]
+        bbox = (min(lons), min(lats), max(lons), max(lats))
+
+        print("Downloading buildings for the street network area...")
+        buildings = ox.features_from_bbox(bbox, tags={'building': True})
+        buildings = buildings[~buildings['building'].isin(EXCLUDED_BUILDING_TYPES)]
+        if len(buildings) == 0:
+            return cls([], [], [], [], max_distance)
+
+        centroids = buildings.to_crs(epsg=PROJECTED_CRS).geometry.centroid
+        names = buildings['name'] if 'name' in buildings else [''] * len(buildings)
+        print(f"Indexed {len(buildings)} public buildings")
+
+        return cls(
+            centroids.x.to_numpy(),
+            centroids.y.to_numpy(),
+            [_clean(name) for name in names],
+            [_clean(building_type) for building_type in buildings['building']],
+            max_distance
+        )
+
+    def nearest_many(self, lats, lons):
+        """
+        Closest public building for many positions at once.
+
+        Returns:
+            Tuple of (names, types) arrays, with '' where no building is within max_distance
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        names = np.full(len(lats), '', dtype=object)
+        types = np.full(len(lats), '', dtype=object)
+
+        if self.tree is None:
+            return names, types
+
+        x, y = self.transformer.transform(lons, lats)
+        _, idx = self.tree.query(np.column_stack([x, y]), distance_upper_bound=self.max_distance)
+
+        found = idx < len(self.x)
+        names[found] = self.names[idx[found]]
+        types[found] = self.types[idx[found]]
+        return names, types
+
+    def nearest(self, lat, lon):
+        """Closest public building to a position as (name, type), or ('', '') if none is nearby."""
+        names, types = self.nearest_many([lat], [lon])
+        return names[0], types[0]
+
+    def __getstate__(self):
+        return {
+            'x': self.x, 'y': self.y, 'names': self.names,
+            'types': self.types, 'max_distance': self.max_distance
+        }
+
+    def __setstate__(self, state):
+        self.__init__(state['x'], state['y'], state['names'], state['types'], state['max_distance'])
+
+
+_building_indexes = weakref.WeakKeyDictionary()
+_building_indexes_lock = threading.Lock()
+
+
+def get_building_index(graph, cache_dir):
+    """
+    Building index for a street graph, shared in memory and persisted in cache_dir.
+
+    The on-disk file is named after the graph's 'cache_key' (set by load_street_network),
+    so the Overpass download happens once per place rather than once per run.
+    """
+    with _building_indexes_lock:
+        index = _building_indexes.get(graph)
+        if index is not None:
+            return index
+
+        path = None
+        if graph.graph.get('cache_key'):
+            file_name = re.sub(r'[^a-z0-9]+', '_', graph.graph['cache_key'].lower()).strip('_')
+            path = os.path.join(cache_dir, f"{file_name}_buildings.pickle")
+
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    index = pickle.load(f)
+                print(f"Loaded building index from cache: {path}")
+            except Exception as e:
+                print(f"Could not read cached building index {path}: {e}")
+
+        if index is None:
+            try:
+                index = BuildingIndex.from_graph(graph)
+            except Exception as e:
+                # No buildings found or error - use an empty index but do not persist it
+                print(f"Could not download buildings: {e}")
+                index = BuildingIndex([], [], [], [])
+                path = None
+            if path:
+                try:
+                    os.makedirs(cache_dir, exist_ok=True)
+                    tmp_path = f"{path}.{os.getpid()}.tmp"
+                    with open(tmp_path, 'wb') as f:
+                        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    os.replace(tmp_path, path)
+                except Exception as e:
+                    print(f"Could not write building index cache {path}: {e}")
+
+        _building_indexes[graph] = index
+        return index
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Compiled Street Graph
+Array (CSR) representation of an OSMnx street network with fast cached routing.
+"""
+
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+
+class CompiledStreetGraph:
+    """
+    Street network compiled into NumPy arrays and a SciPy CSR adjacency matrix.
+
+    Nodes are renumbered 0..N-1; node_ids maps an index back to the OSM node ID.
+    Parallel edges are collapsed to the shortest one, which is the edge
+    nx.shortest_path(weight='length') would use. Routing runs SciPy's compiled
+    Dijkstra and keeps two LRU caches: whole routes by (start, end), and the
+    predecessor tree of recent sources, so any further route from the same start
+    is just a walk back through an array.
+    """
+
+    def __init__(self, node_ids, lat, lon, indptr, indices, lengths, route_cache_size=4096, tree_cache_size=32,
+                 edge_keys=None):
+        """
+        Build the compiled graph from its arrays (see from_networkx).
+
+        Args:
+            node_ids: OSM node ID for each node index
+            lat: Latitude for each node index
+            lon: Longitude for each node index
+            indptr: CSR row pointer array
+            indices: CSR column (target node index) array
+            lengths: CSR edge length array in meters
+            route_cache_size: Maximum number of cached routes
+            tree_cache_size: Maximum number of cached shortest-path trees
+            edge_keys: Precomputed sorted edge keys (computed from indptr and indices if None)
+        """
+        self.node_ids = node_ids
+        self.lat = lat
+        self.lon = lon
+        self.matrix = csr_matrix((lengths, indices, indptr), shape=(len(node_ids), len(node_ids)))
+        # Keep the arrays the matrix actually uses: scipy downcasts int64 index arrays to int32 when
+        # they fit, so sharing the originals would make every attached process build its own copy
+        self.indptr = self.matrix.indptr
+        self.indices = self.matrix.indices
+        self.lengths = self.matrix.data
+        self.node_index = {int(node): i for i, node in enumerate(node_ids)}
+
+        # Sorted (source * N + target) keys for vectorized edge lookups
+        if edge_keys is None:
+            rows = np.repeat(np.arange(len(node_ids), dtype=np.int64), np.diff(indptr))
+            edge_keys = rows * len(node_ids) + indices
+        self._edge_keys = edge_keys
+
+        self.route_cache_size = route_cache_size
+        self.tree_cache_size = tree_cache_size
+        self._routes = OrderedDict()
+        self._trees = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_networkx(cls, graph, **kwargs):
+        """Compile a NetworkX (Multi)DiGraph with 'x', 'y' node and 'length' edge attributes."""
+        node_ids = np.fromiter(graph.nodes(), dtype=np.int64, count=graph.number_of_nodes())
+        node_index = {int(node): i for i, node in enumerate(node_ids)}
+        lat = np.array([graph.nodes[node]['y'] for node in node_ids], dtype=np.float64)
+        lon = np.array([graph.nodes[node]['x'] for node in node_ids], dtype=np.float64)
+
+        shortest = {}
+        for u, v, length in graph.edges(data='length', default=0.0):
+            key = (node_index[u], node_index[v])
+            if key not in shortest or length < shortest[key]:
+                shortest[key] = length
+
+        num_edges = len(shortest)
+        rows = np.fromiter((k[0] for k in shortest), dtype=np.int64, count=num_edges)
+        cols = np.fromiter((k[1] for k in shortest), dtype=np.int64, count=num_edges)
+        lengths = np.fromiter(shortest.values(), dtype=np.float64, count=num_edges)
+
+        order = np.lexsort((cols, rows))
+        rows, cols, lengths = rows[order], cols[order], lengths[order]
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(node_ids)), out=indptr[1:])
+
+        # Dijkstra treats explicit zeros as missing edges, so keep zero-length edges barely positive
+        lengths = np.maximum(lengths, 1e-6)
+
+        return cls(node_ids, lat, lon, indptr, cols.astype(np.int32), lengths, **kwargs)
+
+    def _tree(self, source):
+        """Predecessor array of the shortest-path tree rooted at the source index."""
+        with self._lock:
+            if source in self._trees:
+                self._trees.move_to_end(source)
+                return self._trees[source]
+
+        _, predecessors = dijkstra(self.matrix, directed=True, indices=source, return_predecessors=True)
+
+        with self._lock:
+            self._trees[source] = predecessors
+            if len(self._trees) > self.tree_cache_size:
+                self._trees.popitem(last=False)
+        return predecessors
+
+    def route_indices(self, start, end):
+        """
+        Shortest route between two node indices.
+
+        Returns:
+            NumPy array of node indices from start to end, or None if end is unreachable
+        """
+        key = (start, end)
+        with self._lock:
+            if key in self._routes:
+                self._routes.move_to_end(key)
+                return self._routes[key]
+
+        if start == end:
+            route = np.array([start], dtype=np.int64)
+        else:
+            predecessors = self._tree(start)
+            if predecessors[end] < 0:
+                route = None
+            else:
+                path = [end]
+                while path[-1] != start:
+                    path.append(predecessors[path[-1]])
+                route = np.array(path[::-1], dtype=np.int64)
+
+        with self._lock:
+            self._routes[key] = route
+            if len(self._routes) > self.route_cache_size:
+                self._routes.popitem(last=False)
+        return route
+
+    def route(self, start_node, end_node):
+        """
+        Shortest route between two OSM node IDs.
+
+        Returns:
+            List of OSM node IDs, or None if no path exists
+        """
+        route = self.route_indices(self.node_index[start_node], self.node_index[end_node])
+        if route is None:
+            return None
+        return self.node_ids[route].tolist()
+
+    def edge_lengths(self, u, v):
+        """Lengths in meters of the edges u[i] -> v[i], given as arrays of node indices."""
+        keys = np.asarray(u, dtype=np.int64) * len(self.node_ids) + np.asarray(v, dtype=np.int64)
+        return self.lengths[np.searchsorted(self._edge_keys, keys)]
+
+    def route_lengths(self, route):
+        """Segment lengths in meters along a route given as OSM node IDs."""
+        idx = np.fromiter((self.node_index[node] for node in route), dtype=np.int64, count=len(route))
+        return self.edge_lengths(idx[:-1], idx[1:])
+
+
+_compiled_graphs = weakref.WeakKeyDictionary()
+_compiled_graphs_lock = threading.Lock()
+
+
+def get_compiled_graph(graph):
+    """
+    Compile a street graph once and share the result.
+
+    Graphs from load_street_network are shared per place, so every generator
+    for the same city also shares a single compiled graph and its route caches.
+    """
+    with _compiled_graphs_lock:
+        compiled = _compiled_graphs.get(graph)
+        if compiled is None:
+            compiled = CompiledStreetGraph.from_networkx(graph)
+            _compiled_graphs[graph] = compiled
+        return compiled
@@ -1,5 +1,15 @@
 from random_movement import PersonMovementGenerator
+from vectorized_movement import VectorizedMovementSimulator, iter_positions
+from async_sender import AsyncLocationSender
+from scheduler import DeviceScheduler
+from shared_graph import SharedCompiledGraph, CompiledGraphGenerator, attach_compiled_graph
+import numpy as np
+import asyncio
+import multiprocessing
+import queue
+import random
 import requests
+from requests.adapters import HTTPAdapter
 import json
 import os
 import threading
@@ -7,6 +17,19 @@ import time
 
 url_api = os.getenv("URL_API")
 api_key = os.getenv("API_KEY")
+modo_simulacion = os.getenv("MODO_SIMULACION", "programador")
+intervalo_segundos = float(os.getenv("INTERVALO_SEGUNDOS", "10"))
+variacion_intervalo = float(os.getenv("VARIACION_INTERVALO", "0"))
+jitter_intervalo = float(os.getenv("JITTER_INTERVALO", "0.1"))
+resolucion_programador = float(os.getenv("RESOLUCION_PROGRAMADOR", "0.1"))
+max_peticiones_en_vuelo = int(os.getenv("MAX_PETICIONES_EN_VUELO", "100"))
+tamano_lote = int(os.getenv("TAMANO_LOTE", "1"))
+num_procesos = int(os.getenv("NUM_PROCESOS", str(os.cpu_count() or 1)))
+
+# Sesión compartida por todos los hilos para reutilizar conexiones (keep-alive) en lugar de abrir una por ping
+sesion = requests.Session()
+sesion.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max_peticiones_en_vuelo))
+sesion.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=max_peticiones_en_vuelo))
 
 class MandarDatoAPI(PersonMovementGenerator):
     def write_element(self, position, filename, mode='a'):
@@ -17,7 +40,7 @@ class MandarDatoAPI(PersonMovementGenerator):
                 "latitud": float(position['latitude']),
                 "longitud": float(position['longitude'])
             }
-            response = requests.post(f"{url_api}/ubicaciones", json=ubicacion, headers={"X-API-Key": api_key})
+            response = sesion.post(f"{url_api}/ubicaciones", json=ubicacion, headers={"X-API-Key": api_key})
             if response.status_code >= 400:
                 print(f"Error enviando ubicacion: {response.status_code} - {response.text}")
         except Exception as e:
@@ -44,14 +67,185 @@ def generar_movimiento(menor):
     except Exception as e:
         print(f"Error generando movimiento para menor {menor['id']}: {e}")
 
+def agrupar_por_direccion(menores):
+    menores_por_direccion = {}
+    for menor in menores:
+        menores_por_direccion.setdefault(menor['direccion'], []).append(menor['id'])
+    return menores_por_direccion
+
+def crear_simuladores(menores):
+    # Un simulador por ciudad: todos los menores de la misma dirección avanzan en un único tick de NumPy
+    simuladores = []
+    for direccion, ids in agrupar_por_direccion(menores).items():
+        print(f"Iniciando simulador vectorizado para {len(ids)} menores en {direccion}")
+        generador = PersonMovementGenerator(place_name=direccion)
+        simuladores.append(VectorizedMovementSimulator(generador, ids))
+    return simuladores
+
+async def simular_vectorizado(menores):
+    simuladores = crear_simuladores(menores)
+
+    async with AsyncLocationSender(url_api, api_key, max_in_flight=max_peticiones_en_vuelo, batch_size=tamano_lote) as sender:
+        while True:
+            inicio = time.monotonic()
+            for simulador in simuladores:
+                lote = simulador.step(intervalo_segundos)
+                await sender.send_many(iter_positions(lote))
+            print(f"Ubicaciones enviadas: {sender.sent} | Errores: {sender.errors}")
+            await asyncio.sleep(max(0, intervalo_segundos - (time.monotonic() - inicio)))
+
+async def programar(simuladores, sender):
+    # Cada menor es un dispositivo con su propio intervalo; una rueda de tiempos decide cuándo emite cada uno
+    inicio_simulador = np.cumsum([0] + [len(simulador) for simulador in simuladores])
+
+    async def al_vencer(dispositivos, retrasos):
+        dispositivos = np.asarray(dispositivos)
+        retrasos = np.asarray(retrasos)
+        indice_simulador = np.searchsorted(inicio_simulador, dispositivos, side='right') - 1
+
+        for i in np.unique(indice_simulador):
+            seleccion = indice_simulador == i
+            agentes = dispositivos[seleccion] - inicio_simulador[i]
+            # Se emite la posición actual y se avanza hasta la siguiente emisión de cada dispositivo
+            lote = simuladores[i].step(retrasos[seleccion], agentes)
+            await sender.send_many(iter_positions(lote))
+
+    programador = DeviceScheduler(al_vencer, tick_seconds=resolucion_programador, jitter=jitter_intervalo)
+    for dispositivo in range(inicio_simulador[-1]):
+        intervalo = intervalo_segundos * (1 + random.uniform(-variacion_intervalo, variacion_intervalo))
+        programador.add(dispositivo, intervalo)
+
+    print(f"Programando {len(programador)} dispositivos en un único bucle de eventos")
+    await programador.run()
+
+async def simular_programado(menores):
+    simuladores = crear_simuladores(menores)
+
+    async with AsyncLocationSender(url_api, api_key, max_in_flight=max_peticiones_en_vuelo, batch_size=tamano_lote) as sender:
+        await asyncio.gather(programar(simuladores, sender), informar_envios(sender))
+
+async def informar_envios(sender):
+    while True:
+        await asyncio.sleep(intervalo_segundos)
+        print(f"Ubicaciones enviadas: {sender.sent} | Errores: {sender.errors}")
+
+def repartir_en_procesos(menores, procesos):
+    # Los menores de cada ciudad se dividen en fragmentos de como mucho total/procesos menores, y cada fragmento
+    # va al proceso con menos carga; así una ciudad grande se reparte y las pequeñas se agrupan
+    tamano_maximo = max(1, -(-len(menores) // procesos))
+    fragmentos = [
+        (direccion, ids[i:i + tamano_maximo])
+        for direccion, ids in agrupar_por_direccion(menores).items()
+        for i in range(0, len(ids), tamano_maximo)
+    ]
+    fragmentos.sort(key=lambda fragmento: len(fragmento[1]), reverse=True)
+
+    reparto = [[] for _ in range(procesos)]
+    carga = [0] * procesos
+    for direccion, ids in fragmentos:
+        proceso = carga.index(min(carga))
+        reparto[proceso].append((direccion, ids))
+        carga[proceso] += len(ids)
+    return [fragmentos_proceso for fragmentos_proceso in reparto if fragmentos_proceso]
+
+def proceso_simulacion(numero, fragmentos, grafos, cola):
+    try:
+        asyncio.run(simular_fragmentos(numero, fragmentos, grafos, cola))
+    except Exception as e:
+        print(f"Error en el proceso de simulación {numero}: {e}")
+
+async def simular_fragmentos(numero, fragmentos, grafos, cola):
+    # Los grafos se abren sobre la memoria compartida del coordinador; cada fragmento comparte el de su ciudad
+    grafos_compilados = {}
+    simuladores = []
+    for direccion, ids in fragmentos:
+        if direccion not in grafos_compilados:
+            grafos_compilados[direccion] = attach_compiled_graph(grafos[direccion])
+        generador = CompiledGraphGenerator(grafos_compilados[direccion])
+        simuladores.append(VectorizedMovementSimulator(generador, ids))
+
+    async with AsyncLocationSender(url_api, api_key, max_in_flight=max_peticiones_en_vuelo, batch_size=tamano_lote) as sender:
+        await asyncio.gather(programar(simuladores, sender), reportar_envios(numero, sender, cola))
+
+async def reportar_envios(numero, sender, cola):
+    while True:
+        await asyncio.sleep(intervalo_segundos)
+        # Solo se envían las latencias nuevas para que la lista no crezca indefinidamente
+        latencias, sender.latencies = sender.latencies, []
+        cola.put((numero, sender.sent, sender.errors, len(latencias), sum(latencias)))
+
+def coordinar(procesos, cola):
+    enviadas = {}
+    errores = {}
+    num_latencias = 0
+    suma_latencias = 0.0
+    total_anterior = 0
+    instante_anterior = time.monotonic()
+
+    while any(proceso.is_alive() for proceso in procesos):
+        limite = time.monotonic() + intervalo_segundos
+        while time.monotonic() < limite:
+            try:
+                numero, enviadas_proceso, errores_proceso, n, suma = cola.get(timeout=max(0.01, limite - time.monotonic()))
+            except queue.Empty:
+                break
+            enviadas[numero] = enviadas_proceso
+            errores[numero] = errores_proceso
+            num_latencias += n
+            suma_latencias += suma
+
+        total = sum(enviadas.values())
+        ahora = time.monotonic()
+        tasa = (total - total_anterior) / (ahora - instante_anterior)
+        latencia_media = suma_latencias / num_latencias * 1000 if num_latencias else 0
+        vivos = sum(proceso.is_alive() for proceso in procesos)
+        print(f"Procesos activos: {vivos}/{len(procesos)} | Ubicaciones enviadas: {total} | "
+              f"Errores: {sum(errores.values())} | Tasa: {tasa:,.0f}/s | Latencia media: {latencia_media:.1f} ms")
+        total_anterior, instante_anterior = total, ahora
+
+def simular_multiproceso(menores):
+    # El coordinador carga y compila cada ciudad una sola vez y publica sus arrays en memoria compartida
+    reparto = repartir_en_procesos(menores, num_procesos)
+    grafos = {}
+    for direccion in agrupar_por_direccion(menores):
+        print(f"Compilando el grafo de {direccion} en memoria compartida")
+        grafos[direccion] = SharedCompiledGraph(PersonMovementGenerator(place_name=direccion).compiled_graph)
+
+    contexto = multiprocessing.get_context("spawn")
+    cola = contexto.Queue()
+    procesos = [
+        contexto.Process(target=proceso_simulacion, args=(numero, fragmentos, {d: g.handle for d, g in grafos.items()}, cola), daemon=True)
+        for numero, fragmentos in enumerate(reparto)
+    ]
+    for numero, (proceso, fragmentos) in enumerate(zip(procesos, reparto)):
+        print(f"Proceso {numero}: {sum(len(ids) for _, ids in fragmentos)} menores en {len({d for d, _ in fragmentos})} ciudades")
+        proceso.start()
+
+    try:
+        coordinar(procesos, cola)
+    finally:
+        for proceso in procesos:
+            proceso.terminate()
+            proceso.join()
+        for grafo in grafos.values():
+            grafo.close()
+
 if __name__ == "__main__":
     menores = obtener_id_direccion_menores()
-    threads = []
-    
-    for menor in menores:
-        t = threading.Thread(target=generar_movimiento, args=(menor,))
-        t.start()
-        threads.append(t)
+
+    if modo_simulacion == "vectorizado":
+        asyncio.run(simular_vectorizado(menores))
+    elif modo_simulacion == "multiproceso":
+        simular_multiproceso(menores)
+    elif modo_simulacion == "hilos":
+        threads = []
         
-    for t in threads:
-        t.join()
\ No newline at end of file
+        for menor in menores:
+            t = threading.Thread(target=generar_movimiento, args=(menor,))
+            t.start()
+            threads.append(t)
+            
+        for t in threads:
+            t.join()
+    else:
+        asyncio.run(simular_programado(menores))
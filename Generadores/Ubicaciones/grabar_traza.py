@@ -0,0 +1,121 @@
+"""
+Script: Grabación de trazas de movimiento
+
+Descripción: Simula el movimiento de los menores con un reloj virtual y guarda todas las posiciones en un fichero
+Parquet. La traza se puede reproducir después con reproducir_traza.py tantas veces como se quiera, sin volver a
+calcular rutas ni consultar Overpass, para tener entradas de benchmark reproducibles.
+
+"""
+import argparse
+import random
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+
+from movement_trace import TraceWriter
+from prueba_carga import obtener_menores_api
+from random_movement import PersonMovementGenerator
+from vectorized_movement import VectorizedMovementSimulator
+
+
+def grabar_traza(simuladores, writer, intervalo, duracion_simulada):
+    """Avanza los simuladores tick a tick y escribe las posiciones en orden de tiempo. Devuelve el número de ticks."""
+    ticks = int(np.ceil(duracion_simulada / intervalo))
+    for tick in range(ticks):
+        for simulador in simuladores:
+            writer.write_batch(simulador.step(intervalo))
+        if (tick + 1) % 100 == 0:
+            print(f"Ticks grabados: {tick + 1}/{ticks}")
+    return ticks
+
+
+def main(args):
+    random.seed(args.semilla)
+    np.random.seed(args.semilla)
+
+    if args.usar_menores_api:
+        menores = obtener_menores_api(args.url_api, args.api_key)
+    else:
+        # Identificadores derivados de la semilla, para que dos grabaciones con la misma semilla sean idénticas
+        menores = [
+            {"id": str(uuid.UUID(int=random.getrandbits(128), version=4)), "direccion": args.lugar}
+            for _ in range(args.menores)
+        ]
+
+    menores_por_direccion = {}
+    for menor in menores:
+        menores_por_direccion.setdefault(menor['direccion'], []).append(menor['id'])
+
+    # Todas las ciudades comparten el mismo instante inicial para que la traza quede ordenada por tiempo
+    inicio_simulacion = datetime.fromisoformat(args.inicio) if args.inicio else datetime.now()
+    simuladores = [
+        VectorizedMovementSimulator(PersonMovementGenerator(place_name=direccion), ids, start_time=inicio_simulacion)
+        for direccion, ids in menores_por_direccion.items()
+    ]
+
+    inicio = time.monotonic()
+    with TraceWriter(args.salida, row_group_size=args.filas_por_grupo) as writer:
+        ticks = grabar_traza(simuladores, writer, args.intervalo, args.duracion_simulada)
+    segundos = time.monotonic() - inicio
+
+    print(f"Traza guardada en {args.salida}: {writer.rows} posiciones de {len(menores)} menores, "
+          f"{ticks} ticks en {segundos:.1f} s ({writer.rows / segundos:,.0f} posiciones/s)")
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=('Graba trazas de movimiento simuladas en Parquet.'))
+
+    parser.add_argument(
+                '--salida',
+                required=True,
+                help='Fichero Parquet de salida.')
+    parser.add_argument(
+                '--url_api',
+                default=None,
+                help='URL base de la API, solo con --usar_menores_api.')
+    parser.add_argument(
+                '--api_key',
+                default=None,
+                help='API key, solo con --usar_menores_api.')
+    parser.add_argument(
+                '--menores',
+                type=int,
+                default=1000,
+                help='Número de menores simulados.')
+    parser.add_argument(
+                '--lugar',
+                default="Valencia, Spain",
+                help='Ciudad de los menores simulados.')
+    parser.add_argument(
+                '--usar_menores_api',
+                action='store_true',
+                help='Simular los menores registrados en la API en lugar de menores sintéticos.')
+    parser.add_argument(
+                '--intervalo',
+                type=float,
+                default=10,
+                help='Segundos simulados entre dos posiciones de un menor.')
+    parser.add_argument(
+                '--duracion_simulada',
+                type=float,
+                default=3600,
+                help='Segundos simulados que cubre la traza.')
+    parser.add_argument(
+                '--inicio',
+                default=None,
+                help='Instante inicial de la traza en ISO 8601 (por defecto, ahora).')
+    parser.add_argument(
+                '--semilla',
+                type=int,
+                default=None,
+                help='Semilla para los identificadores y las rutas de los menores.')
+    parser.add_argument(
+                '--filas_por_grupo',
+                type=int,
+                default=100_000,
+                help='Posiciones en memoria antes de escribir un grupo de filas.')
+
+    main(parser.parse_args())
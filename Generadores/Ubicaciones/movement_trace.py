@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Movement Traces
+Columnar (Parquet) recording and reading of simulated movement traces.
+"""
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+TRACE_SCHEMA = pa.schema([
+    ('user_id', pa.dictionary(pa.int32(), pa.string())),
+    ('timestamp', pa.timestamp('us')),
+    ('latitude', pa.float64()),
+    ('longitude', pa.float64()),
+    ('node_id', pa.int64()),
+])
+
+
+class TraceWriter:
+    """
+    Buffered Parquet writer for movement traces.
+
+    Positions are accumulated as NumPy arrays and written as one row group every
+    row_group_size rows, so recording costs a few array appends per tick instead
+    of opening a file and formatting a CSV line per position. User IDs are
+    dictionary-encoded, since every user appears once per tick.
+
+    Use it as a context manager:
+
+        with TraceWriter("trace.parquet") as writer:
+            writer.write_batch(simulator.step(10))
+    """
+
+    def __init__(self, path, row_group_size=100_000, compression='zstd'):
+        """
+        Open the trace file.
+
+        Args:
+            path: Output Parquet file
+            row_group_size: Rows buffered in memory before each write
+            compression: Parquet compression codec
+        """
+        self.path = path
+        self.row_group_size = row_group_size
+        self.writer = pq.ParquetWriter(path, TRACE_SCHEMA, compression=compression)
+        self.rows = 0
+        self._buffer = []
+        self._buffered = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write_batch(self, batch):
+        """Buffer a batch of arrays as returned by VectorizedMovementSimulator.positions()."""
+        columns = {
+            'user_id': np.asarray(batch['user_id']).astype(str),
+            'timestamp': np.asarray(batch['timestamp'], dtype='datetime64[us]'),
+            'latitude': np.asarray(batch['latitude'], dtype=np.float64),
+            'longitude': np.asarray(batch['longitude'], dtype=np.float64),
+            'node_id': np.asarray(batch['node_id'], dtype=np.int64),
+        }
+        self._buffer.append(columns)
+        self._buffered += len(columns['user_id'])
+        if self._buffered >= self.row_group_size:
+            self.flush()
+
+    def write(self, position):
+        """Buffer a single position dictionary, as passed to write_element."""
+        self.write_batch({
+            'user_id': [str(position['user_id'])],
+            'timestamp': [np.datetime64(position['timestamp'], 'us')],
+            'latitude': [position['latitude']],
+            'longitude': [position['longitude']],
+            'node_id': [position.get('node_id', -1)],
+        })
+
+    def flush(self):
+        """Write the buffered positions as one row group."""
+        if not self._buffered:
+            return
+
+        arrays = [
+            pa.array(np.concatenate([columns['user_id'] for columns in self._buffer])).dictionary_encode(),
+            pa.array(np.concatenate([columns['timestamp'] for columns in self._buffer])),
+            pa.array(np.concatenate([columns['latitude'] for columns in self._buffer])),
+            pa.array(np.concatenate([columns['longitude'] for columns in self._buffer])),
+            pa.array(np.concatenate([columns['node_id'] for columns in self._buffer])),
+        ]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=TRACE_SCHEMA))
+
+        self.rows += self._buffered
+        self._buffer = []
+        self._buffered = 0
+
+    def close(self):
+        """Flush the remaining positions and close the file."""
+        self.flush()
+        self.writer.close()
+
+
+def iter_trace_batches(path, batch_size=65_536):
+    """
+    Read a trace in batches of at most batch_size rows.
+
+    Yields:
+        Dictionaries of NumPy arrays with the same keys as VectorizedMovementSimulator.positions()
+    """
+    trace = pq.ParquetFile(path)
+    for record_batch in trace.iter_batches(batch_size=batch_size):
+        yield {
+            'user_id': record_batch.column('user_id').to_numpy(zero_copy_only=False).astype(object),
+            'timestamp': record_batch.column('timestamp').to_numpy().astype('datetime64[us]'),
+            'latitude': record_batch.column('latitude').to_numpy(),
+            'longitude': record_batch.column('longitude').to_numpy(),
+            'node_id': record_batch.column('node_id').to_numpy(),
+        }
+
+
+def trace_num_rows(path):
+    """Number of positions in a trace, read from the Parquet footer."""
+    return pq.ParquetFile(path).metadata.num_rows
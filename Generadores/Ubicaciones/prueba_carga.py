@@ -0,0 +1,157 @@
+"""
+Script: Prueba de carga de la API de ubicaciones
+
+Descripción: Genera ubicaciones con un reloj virtual, sin esperar en tiempo real entre posiciones, y las envía
+a la API tan rápido como sea posible o a una tasa objetivo de mensajes por segundo. Al terminar informa de la
+tasa conseguida, los percentiles de latencia de la API y los errores.
+
+"""
+import argparse
+import asyncio
+import os
+import time
+import uuid
+
+import numpy as np
+import requests
+
+from async_sender import AsyncLocationSender
+from random_movement import PersonMovementGenerator
+from vectorized_movement import VectorizedMovementSimulator, iter_positions
+
+
+def obtener_menores_api(url_api, api_key):
+    response = requests.get(f"{url_api}/menores/id_direccion", headers={"X-API-Key": api_key})
+    response.raise_for_status()
+    return response.json().get("menores", [])
+
+
+def resumen(sender, segundos, segundos_virtuales):
+    latencias = np.array(sender.latencies) * 1000
+    total = sender.sent + sender.errors
+
+    print(f"\n{'='*60}")
+    print(f"Mensajes enviados: {sender.sent} | Errores: {sender.errors} ({(sender.errors / total * 100) if total else 0:.2f}%)")
+    print(f"Duración: {segundos:.1f} s reales, {segundos_virtuales:.0f} s simulados ({segundos_virtuales / segundos:.0f}x)")
+    print(f"Tasa conseguida: {sender.sent / segundos:,.0f} mensajes/s")
+    if len(latencias):
+        p50, p90, p99 = np.percentile(latencias, [50, 90, 99])
+        print(f"Latencia por petición (ms): p50={p50:.1f} p90={p90:.1f} p99={p99:.1f} max={latencias.max():.1f}")
+    print(f"{'='*60}")
+
+
+async def prueba_carga(simuladores, sender, intervalo, tasa, duracion, max_mensajes):
+    """Avanza los simuladores con un reloj virtual y envía sus posiciones, limitando la tasa si se indica."""
+    inicio = time.monotonic()
+    emitidos = 0
+    ticks = 0
+    pendientes = set()
+    tamano_trozo = sender.max_in_flight * sender.batch_size
+
+    while time.monotonic() - inicio < duracion and (not max_mensajes or emitidos < max_mensajes):
+        for simulador in simuladores:
+            posiciones = list(iter_positions(simulador.step(intervalo)))
+
+            for i in range(0, len(posiciones), tamano_trozo):
+                trozo = posiciones[i:i + tamano_trozo]
+
+                if tasa:
+                    # Cada mensaje tiene su instante de salida según la tasa objetivo
+                    espera = inicio + emitidos / tasa - time.monotonic()
+                    if espera > 0:
+                        await asyncio.sleep(espera)
+
+                if len(pendientes) >= 4:
+                    _, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+                pendientes.add(asyncio.create_task(sender.send_many(trozo)))
+                emitidos += len(trozo)
+
+        ticks += 1
+
+    if pendientes:
+        await asyncio.wait(pendientes)
+
+    return time.monotonic() - inicio, ticks * intervalo
+
+
+async def main(args):
+    if args.usar_menores_api:
+        menores = obtener_menores_api(args.url_api, args.api_key)
+    else:
+        menores = [{"id": str(uuid.uuid4()), "direccion": args.lugar} for _ in range(args.menores)]
+
+    menores_por_direccion = {}
+    for menor in menores:
+        menores_por_direccion.setdefault(menor['direccion'], []).append(menor['id'])
+
+    simuladores = [
+        VectorizedMovementSimulator(PersonMovementGenerator(place_name=direccion), ids)
+        for direccion, ids in menores_por_direccion.items()
+    ]
+    print(f"Prueba de carga con {len(menores)} menores en {len(simuladores)} ciudades")
+
+    async with AsyncLocationSender(args.url_api, args.api_key, max_in_flight=args.max_en_vuelo, batch_size=args.tamano_lote) as sender:
+        segundos, segundos_virtuales = await prueba_carga(
+            simuladores, sender, args.intervalo, args.tasa, args.duracion, args.mensajes
+        )
+
+    resumen(sender, segundos, segundos_virtuales)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=('Prueba de carga de la API de ubicaciones con reloj virtual.'))
+
+    parser.add_argument(
+                '--url_api',
+                default=os.getenv("URL_API"),
+                help='URL base de la API (por defecto URL_API).')
+    parser.add_argument(
+                '--api_key',
+                default=os.getenv("API_KEY"),
+                help='API key (por defecto API_KEY).')
+    parser.add_argument(
+                '--menores',
+                type=int,
+                default=1000,
+                help='Número de menores simulados.')
+    parser.add_argument(
+                '--lugar',
+                default="Valencia, Spain",
+                help='Ciudad de los menores simulados.')
+    parser.add_argument(
+                '--usar_menores_api',
+                action='store_true',
+                help='Simular los menores registrados en la API en lugar de menores sintéticos.')
+    parser.add_argument(
+                '--intervalo',
+                type=float,
+                default=10,
+                help='Segundos simulados entre dos posiciones de un menor.')
+    parser.add_argument(
+                '--tasa',
+                type=float,
+                default=0,
+                help='Mensajes por segundo objetivo (0 = tan rápido como sea posible).')
+    parser.add_argument(
+                '--duracion',
+                type=float,
+                default=60,
+                help='Duración máxima de la prueba en segundos reales.')
+    parser.add_argument(
+                '--mensajes',
+                type=int,
+                default=0,
+                help='Número máximo de mensajes (0 = sin límite).')
+    parser.add_argument(
+                '--tamano_lote',
+                type=int,
+                default=1,
+                help='Ubicaciones por petición (más de 1 usa /ubicaciones/lote).')
+    parser.add_argument(
+                '--max_en_vuelo',
+                type=int,
+                default=100,
+                help='Peticiones concurrentes máximas.')
+
+    asyncio.run(main(parser.parse_args()))
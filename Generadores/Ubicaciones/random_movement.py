@@ -9,10 +9,99 @@ import networkx as nx
 import random
 from datetime import datetime, timedelta
 import json
+import os
+import pickle
+import re
 import time
 import sys
 import threading
-from shapely.geometry import Point
+from compiled_graph import get_compiled_graph
+from building_index import get_building_index
+
+
+GRAPH_CACHE_DIR = os.getenv("GRAPH_CACHE_DIR", "graph_cache")
+
+# In-memory layer: one frozen graph per place/network type, shared by every generator in the process
+_street_networks = {}
+_street_network_locks = {}
+_street_networks_lock = threading.Lock()
+
+
+def _street_network_key(place_name, center_point, distance, network_type):
+    if place_name:
+        return f"place_{place_name}_{network_type}"
+    return f"point_{center_point[0]:.5f}_{center_point[1]:.5f}_{distance}_{network_type}"
+
+
+def _street_network_path(key):
+    file_name = re.sub(r'[^a-z0-9]+', '_', key.lower()).strip('_')
+    return os.path.join(GRAPH_CACHE_DIR, f"{file_name}.pickle")
+
+
+def load_street_network(place_name=None, center_point=None, distance=1000, network_type='walk'):
+    """
+    Load a street network through the in-memory and on-disk caches.
+    
+    The graph is downloaded from OpenStreetMap only the first time a place is requested;
+    afterwards it is read from a pickle in GRAPH_CACHE_DIR, and within a process every
+    caller gets the same frozen graph instead of its own copy.
+    
+    Args:
+        place_name: Name of the place (e.g., "Manhattan, New York, USA")
+        center_point: Tuple of (latitude, longitude) as center
+        distance: Distance in meters from center to download street network
+        network_type: OSMnx network type (default 'walk')
+        
+    Returns:
+        Tuple of (graph, nodes) where nodes is a tuple of all node IDs
+    """
+    if not place_name and not center_point:
+        raise ValueError("Either place_name or center_point must be provided")
+    
+    key = _street_network_key(place_name, center_point, distance, network_type)
+    
+    # One lock per key so different cities can load concurrently but each only once
+    with _street_networks_lock:
+        if key in _street_networks:
+            return _street_networks[key]
+        key_lock = _street_network_locks.setdefault(key, threading.Lock())
+    
+    with key_lock:
+        if key in _street_networks:
+            return _street_networks[key]
+        
+        path = _street_network_path(key)
+        graph = None
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    graph = pickle.load(f)
+                print(f"Loaded street network from cache: {path}")
+            except Exception as e:
+                print(f"Could not read cached street network {path}: {e}")
+        
+        if graph is None:
+            print("Downloading street network...")
+            if place_name:
+                graph = ox.graph_from_place(place_name, network_type=network_type)
+            else:
+                graph = ox.graph_from_point(center_point, dist=distance, network_type=network_type)
+            
+            try:
+                os.makedirs(GRAPH_CACHE_DIR, exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(graph, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                print(f"Could not write street network cache {path}: {e}")
+        
+        # Lets derived caches (e.g. the building index) be stored under the same name on disk
+        graph.graph['cache_key'] = key
+        network = (nx.freeze(graph), tuple(graph.nodes()))
+        with _street_networks_lock:
+            _street_networks[key] = network
+        return network
 
 
 class PersonMovementGenerator:
@@ -27,90 +116,32 @@ class PersonMovementGenerator:
             center_point: Tuple of (latitude, longitude) as center
             distance: Distance in meters from center to download street network
         """
-        print("Downloading street network...")
-        
-        if place_name:
-            # Download street network by place name
-            self.graph = ox.graph_from_place(place_name, network_type='walk')
-        elif center_point:
-            # Download street network by center point and radius
-            self.graph = ox.graph_from_point(
-                center_point, 
-                dist=distance, 
-                network_type='walk'
-            )
-        else:
-            raise ValueError("Either place_name or center_point must be provided")
-        
-        # Get all nodes in the graph
-        self.nodes = list(self.graph.nodes())
+        # Shared across all generators for the same place (see load_street_network)
+        self.graph, self.nodes = load_street_network(
+            place_name=place_name,
+            center_point=center_point,
+            distance=distance,
+            network_type='walk'
+        )
         print(f"Loaded {len(self.nodes)} nodes in the street network")
         
-        # Note: Building data will be queried on-demand per location due to data size
-        self.buildings_cache = {}  # Cache for buildings near each location
+        # CSR arrays and route caches, also shared by every generator of the same place
+        self.compiled_graph = get_compiled_graph(self.graph)
+        
+        # Public buildings of the whole area, fetched and indexed on the first lookup
+        self.building_index = None
     
     def get_random_node(self):
         """Get a random node from the street network."""
         return random.choice(self.nodes)
     
     def get_closest_building(self, lat, lon):
-        """Find the closest public building to a given position by querying nearby area."""
+        """Find the closest public building (within 50m) to a given position."""
         try:
-            # Create cache key based on rounded coordinates (200m grid for better caching)
-            cache_key = (round(lat, 2), round(lon, 2))
-            
-            # Check cache first
-            if cache_key not in self.buildings_cache:
-                # Query buildings within 50m radius (smaller for faster queries)
-                try:
-                    buildings = ox.features_from_point((lat, lon), tags={'building': True}, dist=50)
-                    
-                    # Filter for public buildings only (exclude generic/residential types)
-                    if len(buildings) > 0:
-                        excluded_types = ['yes', 'apartments', 'house', 'residential']
-                        public_buildings = buildings[~buildings['building'].isin(excluded_types)]
-                        self.buildings_cache[cache_key] = public_buildings if len(public_buildings) > 0 else None
-                    else:
-                        self.buildings_cache[cache_key] = None
-                except Exception:
-                    # No buildings found or error - cache empty result
-                    self.buildings_cache[cache_key] = None
-            
-            buildings = self.buildings_cache[cache_key]
-            
-            if buildings is None or len(buildings) == 0:
-                return '', ''
+            if self.building_index is None:
+                self.building_index = get_building_index(self.graph, GRAPH_CACHE_DIR)
             
-            # Reproject to a projected CRS for accurate distance calculations
-            # Use UTM zone 30N for Valencia, Spain (EPSG:32630)
-            buildings_proj = buildings.to_crs(epsg=32630)
-            
-            # Create point in the same projected CRS
-            from geopandas import GeoSeries
-            point_gdf = GeoSeries([Point(lon, lat)], crs='EPSG:4326').to_crs(epsg=32630)
-            point_proj = point_gdf.iloc[0]
-            
-            # Calculate distances to all building centroids in projected coordinates
-            centroids = buildings_proj.geometry.centroid
-            distances = centroids.distance(point_proj)
-            closest_idx = distances.idxmin()
-            
-            # Get building information from original (unprojected) dataframe
-            building = buildings.loc[closest_idx]
-            building_type = building.get('building', '')
-            building_name = building.get('name', '')
-            
-            # Handle list values
-            if isinstance(building_type, list):
-                building_type = building_type[0] if building_type else ''
-            if isinstance(building_name, list):
-                building_name = building_name[0] if building_name else ''
-            
-            # Clean strings
-            building_type = str(building_type).replace(',', ';').replace('\n', ' ')
-            building_name = str(building_name).replace(',', ';').replace('\n', ' ')
-            
-            return building_name, building_type
+            return self.building_index.nearest(lat, lon)
         except Exception as e:
             # Silently return empty if error (don't spam logs)
             return '', ''
@@ -126,11 +157,7 @@ class PersonMovementGenerator:
         Returns:
             List of nodes representing the path, or None if no path exists
         """
-        try:
-            route = nx.shortest_path(self.graph, start_node, end_node, weight='length')
-            return route
-        except nx.NetworkXNoPath:
-            return None
+        return self.compiled_graph.route(start_node, end_node)
     
     def get_coordinates_from_route(self, route):
         """
@@ -191,10 +218,7 @@ class PersonMovementGenerator:
                 waypoints[i + 1] = end
             
             # Calculate distance for this segment
-            segment_distance = sum(
-                self.graph[route[j]][route[j+1]][0]['length'] 
-                for j in range(len(route) - 1)
-            )
+            segment_distance = float(self.compiled_graph.route_lengths(route).sum())
             total_distance += segment_distance
             
             # Get coordinates
@@ -247,9 +271,11 @@ class PersonMovementGenerator:
             'longitude': coordinates[0][1]
         })
         
+        route_distances = self.compiled_graph.route_lengths(route)
+        
         for i in range(len(route) - 1):
             # Get distance between consecutive nodes
-            distance = self.graph[route[i]][route[i+1]][0]['length']
+            distance = route_distances[i]
             
             # Calculate time to travel this distance
             travel_time = distance / speed_mps
@@ -340,10 +366,7 @@ class PersonMovementGenerator:
                         route_distances = [0]
                     else:
                         # Calculate distances between consecutive nodes
-                        route_distances = []
-                        for i in range(len(current_route) - 1):
-                            dist = self.graph[current_route[i]][current_route[i+1]][0]['length']
-                            route_distances.append(dist)
+                        route_distances = self.compiled_graph.route_lengths(current_route).tolist()
                     
                     current_position = 0
                     current_node = current_route[0]
@@ -483,10 +506,7 @@ class PersonMovementGenerator:
                         current_route = [current_node]
                         route_distances = [0]
                     else:
-                        route_distances = []
-                        for i in range(len(current_route) - 1):
-                            dist = self.graph[current_route[i]][current_route[i+1]][0]['length']
-                            route_distances.append(dist)
+                        route_distances = self.compiled_graph.route_lengths(current_route).tolist()
                     
                     current_position = 0
                     current_node = current_route[0]
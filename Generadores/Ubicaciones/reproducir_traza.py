@@ -0,0 +1,165 @@
+"""
+Script: Reproducción de trazas de movimiento
+
+Descripción: Envía una traza grabada con grabar_traza.py a la API de ubicaciones, o la publica directamente en el
+tópico de Pub/Sub que lee el pipeline (o en el emulador, si PUBSUB_EMULATOR_HOST está definida). Respeta los tiempos
+de la traza a velocidad real (1), acelerada (N) o tan rápido como sea posible (0).
+
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import numpy as np
+from google.cloud import pubsub_v1
+
+from async_sender import AsyncLocationSender
+from movement_trace import iter_trace_batches, trace_num_rows
+from vectorized_movement import iter_positions
+
+
+def tramos_por_instante(lote):
+    """Divide un lote de la traza en tramos consecutivos que comparten el mismo instante."""
+    cortes = np.flatnonzero(np.diff(lote['timestamp'].astype(np.int64))) + 1
+    limites = np.concatenate([[0], cortes, [len(lote['timestamp'])]])
+    for inicio, fin in zip(limites[:-1], limites[1:]):
+        yield {clave: valores[inicio:fin] for clave, valores in lote.items()}
+
+
+async def reproducir(traza, enviar, velocidad, desplazar_tiempo):
+    """
+    Reproduce la traza llamando a enviar(posiciones) por cada instante.
+
+    Con velocidad > 0 espera hasta que el instante de la traza, escalado por la velocidad, corresponda al tiempo
+    transcurrido. Con desplazar_tiempo los timestamps se trasladan para que la traza empiece ahora.
+    Devuelve el número de posiciones y los segundos reales empleados.
+    """
+    inicio = time.monotonic()
+    origen_traza = None
+    desplazamiento = np.timedelta64(0, 'us')
+    posiciones = 0
+
+    for lote in iter_trace_batches(traza):
+        for tramo in tramos_por_instante(lote):
+            instante = tramo['timestamp'][0]
+            if origen_traza is None:
+                origen_traza = instante
+                if desplazar_tiempo:
+                    desplazamiento = np.datetime64('now', 'us') - origen_traza
+
+            if velocidad:
+                segundos_traza = (instante - origen_traza) / np.timedelta64(1, 's')
+                espera = inicio + segundos_traza / velocidad - time.monotonic()
+                if espera > 0:
+                    await asyncio.sleep(espera)
+
+            tramo['timestamp'] = tramo['timestamp'] + desplazamiento
+            await enviar(list(iter_positions(tramo)))
+            posiciones += len(tramo['user_id'])
+
+    return posiciones, time.monotonic() - inicio
+
+
+async def reproducir_en_api(args):
+    async with AsyncLocationSender(args.url_api, args.api_key, max_in_flight=args.max_en_vuelo, batch_size=args.tamano_lote) as sender:
+        posiciones, segundos = await reproducir(args.traza, sender.send_many, args.velocidad, args.desplazar_tiempo)
+    print(f"Enviadas: {sender.sent} | Errores: {sender.errors}")
+    return posiciones, segundos
+
+
+async def reproducir_en_pubsub(args):
+    # El cliente usa el emulador automáticamente si PUBSUB_EMULATOR_HOST está definida
+    publisher = pubsub_v1.PublisherClient(
+        batch_settings=pubsub_v1.types.BatchSettings(max_messages=1000, max_latency=0.05)
+    )
+    if args.topico.startswith("projects/"):
+        topic_path = args.topico
+    else:
+        topic_path = publisher.topic_path(args.proyecto, args.topico)
+
+    errores = 0
+
+    async def publicar(posiciones):
+        nonlocal errores
+        # Mismo mensaje que publica la API en /ubicaciones, con el instante de publicación como ingesta
+        t_ingesta = time.time()
+        futures = [
+            publisher.publish(topic_path, json.dumps({**AsyncLocationSender.to_payload(posicion), "t_ingesta": t_ingesta}).encode("utf-8"))
+            for posicion in posiciones
+        ]
+        for future in futures:
+            try:
+                await asyncio.wrap_future(future)
+            except Exception as e:
+                print(f"Error publicando ubicacion: {e}")
+                errores += 1
+
+    posiciones, segundos = await reproducir(args.traza, publicar, args.velocidad, args.desplazar_tiempo)
+    print(f"Publicadas: {posiciones - errores} | Errores: {errores}")
+    return posiciones, segundos
+
+
+async def main(args):
+    print(f"Reproduciendo {trace_num_rows(args.traza)} posiciones de {args.traza} en {args.destino} "
+          f"({'máxima velocidad' if not args.velocidad else f'{args.velocidad:g}x'})")
+
+    if args.destino == 'pubsub':
+        posiciones, segundos = await reproducir_en_pubsub(args)
+    else:
+        posiciones, segundos = await reproducir_en_api(args)
+
+    print(f"{posiciones} posiciones en {segundos:.1f} s ({posiciones / segundos:,.0f} posiciones/s)")
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=('Reproduce una traza de movimiento en la API o en Pub/Sub.'))
+
+    parser.add_argument(
+                '--traza',
+                required=True,
+                help='Fichero Parquet grabado con grabar_traza.py.')
+    parser.add_argument(
+                '--destino',
+                choices=['api', 'pubsub'],
+                default='api',
+                help='Enviar a la API o publicar directamente en Pub/Sub.')
+    parser.add_argument(
+                '--velocidad',
+                type=float,
+                default=1,
+                help='Factor de velocidad respecto a los tiempos de la traza (0 = tan rápido como sea posible).')
+    parser.add_argument(
+                '--desplazar_tiempo',
+                action='store_true',
+                help='Trasladar los timestamps para que la traza empiece en el momento de la reproducción.')
+    parser.add_argument(
+                '--url_api',
+                default=os.getenv("URL_API"),
+                help='URL base de la API (por defecto URL_API).')
+    parser.add_argument(
+                '--api_key',
+                default=os.getenv("API_KEY"),
+                help='API key (por defecto API_KEY).')
+    parser.add_argument(
+                '--tamano_lote',
+                type=int,
+                default=1,
+                help='Ubicaciones por petición a la API (más de 1 usa /ubicaciones/lote).')
+    parser.add_argument(
+                '--max_en_vuelo',
+                type=int,
+                default=100,
+                help='Peticiones concurrentes máximas a la API.')
+    parser.add_argument(
+                '--proyecto',
+                default=os.getenv("ID_PROYECTO"),
+                help='Proyecto de Pub/Sub (por defecto ID_PROYECTO).')
+    parser.add_argument(
+                '--topico',
+                default=os.getenv("TOPICO_UBICACIONES"),
+                help='Tópico de ubicaciones, nombre o ruta completa (por defecto TOPICO_UBICACIONES).')
+
+    asyncio.run(main(parser.parse_args()))
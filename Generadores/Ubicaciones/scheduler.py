@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Device Scheduler
+Drives the periodic ticks of many simulated devices from one asyncio event loop.
+"""
+
+import asyncio
+import random
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel.
+
+    Time is split into ticks of tick_seconds and items are hashed into num_slots
+    slots by their due tick; items further away than one revolution carry a
+    count of remaining rounds. Scheduling is O(1) and each tick only touches the
+    items in one slot, regardless of how many devices are scheduled.
+    """
+
+    def __init__(self, tick_seconds=0.1, num_slots=1024):
+        """
+        Initialize the wheel.
+
+        Args:
+            tick_seconds: Resolution of the wheel in seconds
+            num_slots: Number of slots in one revolution
+        """
+        self.tick_seconds = tick_seconds
+        self.num_slots = num_slots
+        self.slots = [[] for _ in range(num_slots)]
+        self.current = 0
+        self.size = 0
+
+    def schedule(self, item, delay):
+        """Schedule item to be returned by advance() after delay seconds (at least one tick)."""
+        ticks = max(1, round(delay / self.tick_seconds))
+        slot = (self.current + ticks) % self.num_slots
+        self.slots[slot].append([(ticks - 1) // self.num_slots, item])
+        self.size += 1
+
+    def advance(self):
+        """Move the wheel one tick forward and return the items that became due."""
+        self.current = (self.current + 1) % self.num_slots
+        entries = self.slots[self.current]
+        if not entries:
+            return []
+
+        due = []
+        pending = []
+        for entry in entries:
+            if entry[0] == 0:
+                due.append(entry[1])
+            else:
+                entry[0] -= 1
+                pending.append(entry)
+        self.slots[self.current] = pending
+        self.size -= len(due)
+        return due
+
+
+class DeviceScheduler:
+    """
+    Runs every device's periodic tick from a single event loop.
+
+    Each device has its own interval; every firing is rescheduled with a random
+    jitter so devices added together drift apart instead of firing in bursts.
+    Due devices are handed to the on_due coroutine in groups, together with the
+    delay until each one fires again. The loop keeps an absolute tick deadline,
+    so slow callbacks make it catch up instead of drifting.
+    """
+
+    def __init__(self, on_due, tick_seconds=0.1, num_slots=1024, jitter=0.1, max_pending_batches=100):
+        """
+        Initialize the scheduler.
+
+        Args:
+            on_due: Coroutine function called as on_due(devices, next_delays)
+            tick_seconds: Resolution of the timing wheel in seconds
+            num_slots: Number of slots of the timing wheel
+            jitter: Relative jitter applied to every interval (0.1 = +/-10%)
+            max_pending_batches: Maximum on_due calls running at the same time
+        """
+        self.on_due = on_due
+        self.wheel = TimingWheel(tick_seconds, num_slots)
+        self.jitter = jitter
+        self.max_pending_batches = max_pending_batches
+        self.intervals = {}
+        self._pending = set()
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def add(self, device, interval_seconds):
+        """Add a device that ticks every interval_seconds; its first tick is spread over one interval."""
+        self.intervals[device] = interval_seconds
+        self.wheel.schedule(device, random.uniform(0, interval_seconds))
+
+    def remove(self, device):
+        """Stop ticking a device (it is dropped the next time it becomes due)."""
+        self.intervals.pop(device, None)
+
+    def _next_delay(self, device):
+        interval = self.intervals[device]
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    async def run(self):
+        """Tick the wheel forever, calling on_due for the devices that become due."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+
+        while True:
+            deadline += self.wheel.tick_seconds
+            await asyncio.sleep(max(0, deadline - loop.time()))
+
+            due = [device for device in self.wheel.advance() if device in self.intervals]
+            if not due:
+                continue
+
+            delays = []
+            for device in due:
+                delay = self._next_delay(device)
+                self.wheel.schedule(device, delay)
+                delays.append(delay)
+
+            # Run callbacks concurrently with the wheel, but bound how many can pile up
+            if len(self._pending) >= self.max_pending_batches:
+                await asyncio.wait(self._pending, return_when=asyncio.FIRST_COMPLETED)
+            task = asyncio.create_task(self.on_due(due, delays))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Shared Street Graphs
+Publishes compiled street graph arrays in shared memory so worker processes can route without copies.
+"""
+
+import random
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from compiled_graph import CompiledStreetGraph
+
+
+SHARED_ARRAYS = ('node_ids', 'lat', 'lon', 'indptr', 'indices', 'lengths', '_edge_keys')
+
+# Offsets are aligned so every array view starts on a cache line
+ALIGNMENT = 64
+
+
+class SharedCompiledGraph:
+    """
+    Owner of a shared memory block holding the arrays of a CompiledStreetGraph.
+
+    The coordinator process creates it once per city and passes the picklable
+    handle to the workers, which rebuild the graph around views of the same
+    memory with attach_compiled_graph. Only the node ID dictionary and the
+    route caches are private to each process.
+    """
+
+    def __init__(self, compiled):
+        """
+        Copy the arrays of a compiled graph into a new shared memory block.
+
+        Args:
+            compiled: CompiledStreetGraph to share
+        """
+        arrays = [np.ascontiguousarray(getattr(compiled, key)) for key in SHARED_ARRAYS]
+
+        layout = []
+        offset = 0
+        for key, array in zip(SHARED_ARRAYS, arrays):
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            layout.append((key, array.dtype.str, array.shape, offset))
+            offset += array.nbytes
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for (_, _, _, start), array in zip(layout, arrays):
+            self.shm.buf[start:start + array.nbytes] = array.view(np.uint8).reshape(-1)
+
+        self.handle = {'name': self.shm.name, 'layout': layout}
+
+    def close(self):
+        """Release and remove the shared memory block (call once the workers have exited)."""
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _open_shared_memory(name):
+    try:
+        # Python 3.13+: attaching processes must not unlink the block when they exit
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def attach_compiled_graph(handle, **kwargs):
+    """
+    Build a CompiledStreetGraph over the shared memory described by a SharedCompiledGraph handle.
+
+    The returned graph keeps a reference to the shared memory block, which stays
+    mapped for as long as the graph is alive.
+    """
+    shm = _open_shared_memory(handle['name'])
+    arrays = {
+        key: np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+        for key, dtype, shape, offset in handle['layout']
+    }
+
+    compiled = CompiledStreetGraph(
+        arrays['node_ids'], arrays['lat'], arrays['lon'],
+        arrays['indptr'], arrays['indices'], arrays['lengths'],
+        edge_keys=arrays['_edge_keys'], **kwargs
+    )
+    compiled.shared_memory = shm
+    return compiled
+
+
+class CompiledGraphGenerator:
+    """
+    Minimal stand-in for PersonMovementGenerator backed only by a compiled graph.
+
+    VectorizedMovementSimulator only needs compiled_graph and get_random_node,
+    so worker processes can simulate without loading the NetworkX graph.
+    Nearby buildings (resolve_pois) are not available this way.
+    """
+
+    def __init__(self, compiled_graph, rng=None):
+        """
+        Initialize the generator.
+
+        Args:
+            compiled_graph: CompiledStreetGraph to route on
+            rng: random.Random used to pick destinations (the global random module by default)
+        """
+        self.compiled_graph = compiled_graph
+        self.graph = None
+        self.rng = rng or random
+
+    def get_random_node(self):
+        """Get a random OSM node ID from the street network."""
+        node_ids = self.compiled_graph.node_ids
+        return int(node_ids[self.rng.randrange(len(node_ids))])
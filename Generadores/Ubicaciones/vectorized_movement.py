@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Vectorized Multi-Agent Movement Simulator
+Advances many simulated people along real roads in a single NumPy tick.
+"""
+
+import sys
+from datetime import datetime
+
+import numpy as np
+
+from building_index import get_building_index
+from random_movement import GRAPH_CACHE_DIR
+
+
+class VectorizedMovementSimulator:
+    """
+    Moves many agents over the street network of a PersonMovementGenerator.
+
+    Every route is stored in flat NumPy arrays (node coordinates and a cumulative
+    distance that keeps increasing across routes), and each agent only keeps the
+    slice of its current route and how many meters it has walked along it. A tick
+    then advances and interpolates every agent with array operations; Python code
+    only runs for the agents that reached the end of their route and need a new one.
+
+    Street names are not resolved here, since they are per-edge dictionary lookups and
+    would bring back the per-agent loop. Nearby buildings can be added with
+    resolve_pois, which queries the shared building index for the whole batch.
+    """
+
+    def __init__(self, generator, user_ids, speed_mps=1.4, start_time=None, resolve_pois=False):
+        """
+        Initialize the simulator.
+
+        Args:
+            generator: PersonMovementGenerator providing the graph and routing
+            user_ids: Sequence with one user ID per agent
+            speed_mps: Speed in meters per second, a scalar or one value per agent
+            start_time: Starting datetime shared by all agents (defaults to now)
+            resolve_pois: Add 'poi_name' and 'poi_type' of the closest public building to each batch
+        """
+        self.generator = generator
+        self.compiled_graph = generator.compiled_graph
+        self.user_ids = np.asarray(user_ids, dtype=object)
+
+        num_agents = len(self.user_ids)
+        self.speed_mps = np.broadcast_to(np.asarray(speed_mps, dtype=np.float64), (num_agents,)).copy()
+        self.start_time = np.datetime64(start_time or datetime.now(), 'us')
+        self.elapsed_seconds = np.zeros(num_agents, dtype=np.float64)
+        self.building_index = get_building_index(generator.graph, GRAPH_CACHE_DIR) if resolve_pois else None
+
+        # Flat storage of all live routes (nodes as compiled graph indices)
+        self._lat = np.empty(0, dtype=np.float64)
+        self._lon = np.empty(0, dtype=np.float64)
+        self._node = np.empty(0, dtype=np.int64)
+        self._cum = np.empty(0, dtype=np.float64)
+
+        # Per-agent view into the flat storage
+        self.route_start = np.zeros(num_agents, dtype=np.int64)
+        self.route_end = np.zeros(num_agents, dtype=np.int64)
+        self.route_base = np.zeros(num_agents, dtype=np.float64)
+        self.route_length = np.zeros(num_agents, dtype=np.float64)
+        self.progress = np.zeros(num_agents, dtype=np.float64)
+
+        # Node indices into the compiled graph, not OSM node IDs
+        self.current_node = np.array(
+            [self.compiled_graph.node_index[generator.get_random_node()] for _ in range(num_agents)],
+            dtype=np.int64
+        )
+        self._assign_routes(np.arange(num_agents))
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def _find_route(self, start):
+        """Route from node index start to a random destination, or None after 10 failed attempts."""
+        for _ in range(10):
+            end = self.compiled_graph.node_index[self.generator.get_random_node()]
+            route = self.compiled_graph.route_indices(start, end)
+            if route is not None:
+                return route
+        return None
+
+    def _assign_routes(self, agent_indices):
+        """Give a new route starting at their current node to the given agents."""
+        if len(agent_indices) == 0:
+            return
+
+        self._maybe_compact()
+
+        lats, lons, nodes, cums = [], [], [], []
+        offset = len(self._cum)
+        base = self._cum[-1] + 1.0 if offset else 0.0
+
+        compiled = self.compiled_graph
+        for agent in agent_indices:
+            start = int(self.current_node[agent])
+            route = self._find_route(start)
+            if route is None:
+                route = np.array([start], dtype=np.int64)
+
+            lengths = compiled.edge_lengths(route[:-1], route[1:])
+            cum = np.empty(len(route), dtype=np.float64)
+            cum[0] = base
+            np.cumsum(lengths, out=cum[1:])
+            cum[1:] += base
+
+            lats.append(compiled.lat[route])
+            lons.append(compiled.lon[route])
+            nodes.append(route)
+            cums.append(cum)
+
+            self.route_start[agent] = offset
+            self.route_end[agent] = offset + len(route) - 1
+            self.route_base[agent] = base
+            self.route_length[agent] = cum[-1] - base
+            self.progress[agent] = 0.0
+
+            offset += len(route)
+            # Leave a gap between routes so the cumulative distance stays strictly increasing
+            base = cum[-1] + 1.0
+
+        self._lat = np.concatenate([self._lat] + lats)
+        self._lon = np.concatenate([self._lon] + lons)
+        self._node = np.concatenate([self._node] + nodes)
+        self._cum = np.concatenate([self._cum] + cums)
+
+    def _maybe_compact(self):
+        """Drop finished routes from the flat storage once they make up most of it."""
+        live = int(np.sum(self.route_end - self.route_start + 1))
+        if len(self._cum) < 2 * live + 100_000:
+            return
+
+        order = np.argsort(self.route_start)
+        slices = [np.arange(self.route_start[a], self.route_end[a] + 1) for a in order]
+        keep = np.concatenate(slices)
+
+        sizes = np.array([len(sl) for sl in slices], dtype=np.int64)
+        new_start = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+        # Re-base each route so the compacted cumulative distance stays increasing
+        old_cum = self._cum[keep]
+        shift = np.repeat(self.route_base[order], sizes)
+        new_base = np.concatenate([[0.0], np.cumsum(self.route_length[order] + 1.0)[:-1]])
+        self._cum = old_cum - shift + np.repeat(new_base, sizes)
+        self._lat = self._lat[keep]
+        self._lon = self._lon[keep]
+        self._node = self._node[keep]
+
+        self.route_start[order] = new_start
+        self.route_end[order] = new_start + sizes - 1
+        self.route_base[order] = new_base
+
+    def positions(self, agent_indices=None):
+        """
+        Interpolate the current position of the given agents (all by default).
+
+        Returns:
+            Dictionary of arrays with 'user_id', 'timestamp', 'latitude', 'longitude' and 'node_id'
+            (plus 'poi_name' and 'poi_type' with resolve_pois)
+        """
+        idx = np.arange(len(self)) if agent_indices is None else np.asarray(agent_indices)
+
+        start = self.route_start[idx]
+        end = self.route_end[idx]
+        target = self.route_base[idx] + self.progress[idx]
+
+        k = np.searchsorted(self._cum, target, side='right') - 1
+        k = np.clip(k, start, np.maximum(end - 1, start))
+        k_next = np.minimum(k + 1, end)
+
+        segment = self._cum[k_next] - self._cum[k]
+        fraction = np.divide(target - self._cum[k], segment, out=np.zeros_like(segment), where=segment > 0)
+        fraction = np.clip(fraction, 0.0, 1.0)
+
+        latitude = self._lat[k] + (self._lat[k_next] - self._lat[k]) * fraction
+        longitude = self._lon[k] + (self._lon[k_next] - self._lon[k]) * fraction
+
+        batch = {
+            'user_id': self.user_ids[idx],
+            'timestamp': self.start_time + (self.elapsed_seconds[idx] * 1e6).astype('timedelta64[us]'),
+            'latitude': latitude,
+            'longitude': longitude,
+            'node_id': self.compiled_graph.node_ids[np.where(fraction >= 1.0, self._node[k_next], self._node[k])]
+        }
+
+        if self.building_index is not None:
+            batch['poi_name'], batch['poi_type'] = self.building_index.nearest_many(latitude, longitude)
+
+        return batch
+
+    def step(self, dt, agent_indices=None):
+        """
+        Emit the current position of the given agents and advance them dt seconds.
+
+        Agents that finished their route get a new one first, as in
+        PersonMovementGenerator.generate_continuous_movement.
+
+        Args:
+            dt: Seconds to advance, a scalar or one value per selected agent
+            agent_indices: Agents to step (default: all)
+
+        Returns:
+            Dictionary of arrays as returned by positions()
+        """
+        idx = np.arange(len(self)) if agent_indices is None else np.asarray(agent_indices)
+
+        finished = idx[self.progress[idx] >= self.route_length[idx]]
+        if len(finished):
+            self.current_node[finished] = self._node[self.route_end[finished]]
+            self._assign_routes(finished)
+
+        batch = self.positions(idx)
+
+        self.progress[idx] = np.minimum(self.progress[idx] + self.speed_mps[idx] * dt, self.route_length[idx])
+        self.elapsed_seconds[idx] += dt
+
+        return batch
+
+
+def iter_positions(batch):
+    """
+    Turn a batch of arrays from VectorizedMovementSimulator into position dictionaries.
+
+    The dictionaries have the same keys write_element expects.
+    """
+    timestamps = np.datetime_as_string(batch['timestamp'], unit='us')
+    for i in range(len(batch['user_id'])):
+        position = {
+            'user_id': batch['user_id'][i],
+            'timestamp': str(timestamps[i]),
+            'latitude': float(batch['latitude'][i]),
+            'longitude': float(batch['longitude'][i]),
+            'node_id': int(batch['node_id'][i])
+        }
+        if 'poi_name' in batch:
+            position['poi_name'] = batch['poi_name'][i]
+            position['poi_type'] = batch['poi_type'][i]
+        yield position
+
+
+if __name__ == "__main__":
+    import time
+    from random_movement import PersonMovementGenerator
+
+    num_agents = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    generator = PersonMovementGenerator(place_name="Valencia, Spain")
+    simulator = VectorizedMovementSimulator(generator, [f"agent_{i}" for i in range(num_agents)])
+
+    start = time.perf_counter()
+    ticks = 100
+    for _ in range(ticks):
+        simulator.step(10)
+    elapsed = time.perf_counter() - start
+    print(f"{num_agents} agents x {ticks} ticks in {elapsed:.2f}s "
+          f"({num_agents * ticks / elapsed:,.0f} positions/s)")
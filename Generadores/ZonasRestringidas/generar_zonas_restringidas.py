@@ -1,11 +1,44 @@
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import os
 import random
+import threading
+import time
 import uuid
 
 url_api = os.getenv("URL_API")
 api_key = os.getenv("API_KEY")
 
+# "uniforme": toda la ciudad; "agrupada": alrededor de focos (colegios, centros de ocio...); "centro": zonas solapadas en el centro
+distribucion_zonas = os.getenv("DISTRIBUCION_ZONAS", "uniforme")
+# Zonas por menor: "uniforme:2:5", "fija:N", "poisson:media" o "pareto:alfa:minimo:maximo" (cola larga)
+zonas_por_menor = os.getenv("ZONAS_POR_MENOR", "uniforme:2:5")
+num_focos = int(os.getenv("NUM_FOCOS", "30"))
+dispersion_foco_metros = float(os.getenv("DISPERSION_FOCO_METROS", "150"))
+dispersion_centro_metros = float(os.getenv("DISPERSION_CENTRO_METROS", "500"))
+# Zonas por petición; más de 1 usa /zonas_restringidas/lote
+tamano_lote_zonas = int(os.getenv("TAMANO_LOTE_ZONAS", "1"))
+if tamano_lote_zonas < 1:
+    raise ValueError(f"TAMANO_LOTE_ZONAS debe ser al menos 1: {tamano_lote_zonas}")
+max_peticiones_en_vuelo = int(os.getenv("MAX_PETICIONES_EN_VUELO", "16"))
+
+coordenadas = {
+    "Madrid": (40.4168, -3.7038),
+    "Barcelona": (41.3851, 2.1734),
+    "Valencia": (39.4699, -0.3763)
+}
+
+nombres_zonas = ["Zona Peligrosa", "Vivienda del bully del menor", "Parque", "Centro Comercial", "Obras", "Zoo", "Carcel", "Puticlub", "Casino"]
+
+METROS_POR_GRADO = 111320
+
+# Sesión compartida por todos los hilos para reutilizar conexiones (keep-alive)
+sesion = requests.Session()
+sesion.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=max_peticiones_en_vuelo))
+sesion.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=max_peticiones_en_vuelo))
+
 def obtener_id_direccion_menores():
     try:
         response = requests.get(f"{url_api}/menores/id_direccion", headers={"X-API-Key": api_key})
@@ -17,49 +50,141 @@ def obtener_id_direccion_menores():
         print(f"Error al obtener los IDs y direccionesº de los menores: {e}")
         return []
 
-def generar_coordenadas_ciudad(direccion):
+def centro_ciudad(direccion):
     ciudad = direccion.split(",")[0].strip()
-    
-    coordenadas = {
-        "Madrid": (40.4168, -3.7038),
-        "Barcelona": (41.3851, 2.1734),
-        "Valencia": (39.4699, -0.3763)
-    }
-    
-    centro_ciudad = coordenadas.get(ciudad, (40.4168, -3.7038))
-    
-    latitud = centro_ciudad[0] + random.uniform(-0.045, 0.045)
-    longitud = centro_ciudad[1] + random.uniform(-0.045, 0.045)
-    
+    return coordenadas.get(ciudad, (40.4168, -3.7038))
+
+def desplazar_metros(latitud, longitud, norte, este):
+    # Aproximación equirectangular, suficiente para desplazamientos de unos pocos kilómetros
+    return (
+        latitud + norte / METROS_POR_GRADO,
+        longitud + este / (METROS_POR_GRADO * np.cos(np.radians(latitud)))
+    )
+
+focos_por_ciudad = {}
+
+def focos_ciudad(direccion):
+    # Los focos de cada ciudad se sortean una vez y los comparten todos sus menores
+    centro = centro_ciudad(direccion)
+    if centro not in focos_por_ciudad:
+        focos_por_ciudad[centro] = (
+            centro[0] + np.random.uniform(-0.045, 0.045, num_focos),
+            centro[1] + np.random.uniform(-0.045, 0.045, num_focos)
+        )
+    return focos_por_ciudad[centro]
+
+def generar_coordenadas_ciudad(direccion, cantidad):
+    centro = centro_ciudad(direccion)
+
+    if distribucion_zonas == "agrupada":
+        latitudes_focos, longitudes_focos = focos_ciudad(direccion)
+        foco = np.random.randint(len(latitudes_focos), size=cantidad)
+        norte, este = np.random.normal(0, dispersion_foco_metros, (2, cantidad))
+        return desplazar_metros(latitudes_focos[foco], longitudes_focos[foco], norte, este)
+
+    if distribucion_zonas == "centro":
+        norte, este = np.random.normal(0, dispersion_centro_metros, (2, cantidad))
+        return desplazar_metros(np.full(cantidad, centro[0]), np.full(cantidad, centro[1]), norte, este)
+
+    latitud = centro[0] + np.random.uniform(-0.045, 0.045, cantidad)
+    longitud = centro[1] + np.random.uniform(-0.045, 0.045, cantidad)
+
     return latitud, longitud
 
+def muestreador_zonas_por_menor(especificacion):
+    tipo, *parametros = especificacion.split(":")
+    parametros = [float(parametro) for parametro in parametros]
+
+    if tipo == "fija":
+        return lambda: int(parametros[0])
+    if tipo == "poisson":
+        return lambda: max(1, int(np.random.poisson(parametros[0])))
+    if tipo == "pareto":
+        alfa, minimo, maximo = parametros
+        return lambda: int(min(maximo, minimo * (1 + np.random.pareto(alfa))))
+    if tipo == "uniforme":
+        return lambda: random.randint(int(parametros[0]), int(parametros[1]))
+    raise ValueError(f"Distribución de zonas por menor desconocida: {especificacion}")
+
+def generar_zonas(menor, cantidad):
+    latitudes, longitudes = generar_coordenadas_ciudad(menor['direccion'], cantidad)
+    radios_peligro = np.random.randint(50, 201, cantidad)
+    margenes_advertencia = np.random.randint(20, 101, cantidad)
+
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "id_menor": menor['id'],
+            "nombre": random.choice(nombres_zonas),
+            "latitud": float(lat),
+            "longitud": float(lon),
+            "radio_peligro": int(radio_peligro),
+            "radio_advertencia": int(radio_peligro + margen)
+        }
+        for lat, lon, radio_peligro, margen in zip(latitudes, longitudes, radios_peligro, margenes_advertencia)
+    ]
+
+def registrar_zonas(zonas):
+    # Una zona va al endpoint individual; varias van juntas al endpoint /lote
+    try:
+        if len(zonas) == 1:
+            response = sesion.post(f"{url_api}/zonas_restringidas", json=zonas[0], headers={"X-API-Key": api_key})
+        else:
+            response = sesion.post(f"{url_api}/zonas_restringidas/lote", json={"zonas_restringidas": zonas}, headers={"X-API-Key": api_key})
+
+        if response.status_code == 201:
+            return True
+        print(f"Error creando zona: {response.status_code} - {response.text}")
+    except Exception as e:
+        print(f"Error enviando zona restringida: {e}")
+    return False
+
+class Progreso:
+    def __init__(self, total):
+        self.total = total
+        self.hechas = 0
+        self.errores = 0
+        self.inicio = time.monotonic()
+        self.ultimo_informe = self.inicio
+        self.lock = threading.Lock()
+
+    def sumar(self, cantidad, correcto):
+        with self.lock:
+            if correcto:
+                self.hechas += cantidad
+            else:
+                self.errores += cantidad
+            ahora = time.monotonic()
+            if ahora - self.ultimo_informe >= 5 or self.hechas + self.errores >= self.total:
+                self.ultimo_informe = ahora
+                segundos = max(ahora - self.inicio, 1e-9)
+                print(f"Zonas creadas: {self.hechas}/{self.total} | Errores: {self.errores} | {self.hechas / segundos:,.0f}/s")
+
 if __name__ == "__main__":
     menores = obtener_id_direccion_menores()
-    nombres_zonas = ["Zona Peligrosa", "Vivienda del bully del menor", "Parque", "Centro Comercial", "Obras", "Zoo", "Carcel", "Puticlub", "Casino"]
 
     if menores:
-        print(f"Generando zonas restringidas para {len(menores)} menores.")
-        for menor in menores:
-            for _ in range(random.randint(2, 5)):
-                lat, lon = generar_coordenadas_ciudad(menor['direccion'])
-                radio_peligro = random.randint(50, 200)
-                
-                zona = {
-                    "id": str(uuid.uuid4()),
-                    "id_menor": menor['id'],
-                    "nombre": random.choice(nombres_zonas),
-                    "latitud": lat,
-                    "longitud": lon,
-                    "radio_peligro": radio_peligro,
-                    "radio_advertencia": radio_peligro + random.randint(20, 100)
-                }
-                
-                try:
-                    response = requests.post(f"{url_api}/zonas_restringidas", json=zona, headers={"X-API-Key": api_key})
-
-                    if response.status_code == 201:
-                        print(f"Zona restringida creada para menor {menor['id']}")
-                    else:
-                        print(f"Error creando zona: {response.status_code} - {response.text}")
-                except Exception as e:
-                    print(f"Error enviando zona restringida: {e}")
+        muestrear_cantidad = muestreador_zonas_por_menor(zonas_por_menor)
+        cantidades = [muestrear_cantidad() for _ in menores]
+        print(f"Generando {sum(cantidades)} zonas restringidas para {len(menores)} menores "
+              f"(distribución {distribucion_zonas}, zonas por menor {zonas_por_menor}).")
+
+        progreso = Progreso(sum(cantidades))
+        # Como mucho 4 peticiones encoladas por hilo, para no tener todas las zonas en memoria a la vez
+        huecos = threading.BoundedSemaphore(max_peticiones_en_vuelo * 4)
+        pendientes = []
+
+        def enviar(lote):
+            huecos.acquire()
+            futuro = pool.submit(registrar_zonas, lote)
+            futuro.add_done_callback(lambda f: (huecos.release(), progreso.sumar(len(lote), f.result())))
+
+        with ThreadPoolExecutor(max_workers=max_peticiones_en_vuelo) as pool:
+            # Los lotes pueden mezclar zonas de varios menores
+            for menor, cantidad in zip(menores, cantidades):
+                pendientes.extend(generar_zonas(menor, cantidad))
+                while len(pendientes) >= tamano_lote_zonas:
+                    enviar(pendientes[:tamano_lote_zonas])
+                    pendientes = pendientes[tamano_lote_zonas:]
+            if pendientes:
+                enviar(pendientes)
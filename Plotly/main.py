@@ -1,21 +1,57 @@
 import os
+import threading
+import time
+from collections import Counter
 import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output
 import plotly.express as px
+import numpy as np
 import pandas as pd
-from google.cloud import bigquery
+from google.cloud import bigquery, bigquery_storage
 
 app = dash.Dash(__name__)
 server = app.server
 
 project_id = os.getenv("PROJECT_ID")
 client = bigquery.Client(project=project_id)
+bqstorage_client = bigquery_storage.BigQueryReadClient()
 dataset_id = "monitoreo_dataset"
 
-def get_data():
-    """Consulta datos de BigQuery para los KPIs y gráficos."""
+COLUMNAS_NOTIFICACIONES = ['id_menor', 'nombre_menor', 'latitud', 'longitud', 'fecha', 'estado']
+VENTANA = pd.Timedelta(hours=24)
+
+TIPOS_NOTIFICACIONES = {
+    'estado': 'category',
+    'nombre_menor': 'category',
+    'latitud': 'float32',
+    'longitud': 'float32'
+}
+
+def tipar_notificaciones(df):
+    """Aplica los tipos compactos de la ventana: categorías para textos repetidos y float32 para coordenadas."""
+    return df.astype(TIPOS_NOTIFICACIONES)
+
+def inicio_ventana():
+    """Inicio de la ventana común del mapa y los conteos: hace 24 horas, redondeado a la hora en punto.
+
+    Los conteos salen de la vista agregada por horas, así que todos los gráficos usan horas completas y cubren
+    entre 24 y 25 horas.
+    """
+    return (pd.Timestamp.now(tz="UTC") - VENTANA).floor("h")
+
+def get_data(watermark=None):
+    """Consulta datos de BigQuery para los KPIs y gráficos.
+
+    Sin watermark lee la ventana completa desde inicio_ventana(); con watermark solo las filas con fecha posterior.
+    """
     
+    filtro_fecha = "fecha >= @inicio"
+    parametros = [bigquery.ScalarQueryParameter("inicio", "TIMESTAMP", inicio_ventana().to_pydatetime())]
+    if watermark is not None:
+        filtro_fecha += " AND fecha > @watermark"
+        parametros.append(bigquery.ScalarQueryParameter("watermark", "TIMESTAMP", watermark.to_pydatetime()))
+
     query_notificaciones = f"""
         SELECT 
             id_menor, 
@@ -25,15 +61,18 @@ def get_data():
             fecha, 
             estado 
         FROM `{project_id}.{dataset_id}.historico_notificaciones`
-        WHERE fecha >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 24 HOUR)
+        WHERE {filtro_fecha}
         ORDER BY fecha DESC
     """
     
     try:
-        df_notificaciones = client.query(query_notificaciones).to_dataframe()
+        job_config = bigquery.QueryJobConfig(query_parameters=parametros)
+        # Lectura por la Storage Read API en record batches de Arrow; los resultados pequeños siguen por REST
+        tabla = client.query(query_notificaciones, job_config=job_config).to_arrow(bqstorage_client=bqstorage_client)
+        df_notificaciones = tipar_notificaciones(tabla.to_pandas())
     except Exception as e:
         print(f"Error consultando notificaciones: {e}")
-        df_notificaciones = pd.DataFrame(columns=['id_menor', 'nombre_menor', 'latitud', 'longitud', 'fecha', 'estado'])
+        df_notificaciones = tipar_notificaciones(pd.DataFrame(columns=COLUMNAS_NOTIFICACIONES))
 
     total_menores = 0
     try:
@@ -47,6 +86,132 @@ def get_data():
 
     return df_notificaciones, total_menores
 
+def contar_estados(df):
+    """Cuenta las notificaciones por (nombre_menor, estado)."""
+    return Counter(zip(df['nombre_menor'], df['estado']))
+
+def get_conteos():
+    """Lee los conteos por (nombre_menor, estado) de la vista materializada horaria, o None si falla."""
+    query_conteos = f"""
+        SELECT 
+            nombre_menor, 
+            estado, 
+            SUM(cantidad) AS cantidad 
+        FROM `{project_id}.{dataset_id}.alertas_por_menor_hora`
+        WHERE hora >= @inicio
+        GROUP BY nombre_menor, estado
+    """
+
+    try:
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("inicio", "TIMESTAMP", inicio_ventana().to_pydatetime())
+        ])
+        df_conteos = client.query(query_conteos, job_config=job_config).to_dataframe()
+    except Exception as e:
+        print(f"Error consultando conteos agregados: {e}")
+        return None
+
+    return Counter({(fila.nombre_menor, fila.estado): int(fila.cantidad) for fila in df_conteos.itertuples(index=False)})
+
+TAMANO_CELDA_GRADOS = float(os.getenv("TAMANO_CELDA_GRADOS", "0.01"))
+MAX_PUNTOS_MAPA = int(os.getenv("MAX_PUNTOS_MAPA", "2000"))
+ESTADOS = ['PELIGRO', 'ADVERTENCIA', 'OK']
+
+def agrupar_en_celdas(df, tamano_celda=TAMANO_CELDA_GRADOS):
+    """Agrupa las posiciones en una rejilla de tamano_celda grados con el conteo de cada estado por celda.
+
+    Cada celda se representa en su centroide y toma como estado el más grave presente.
+    """
+    latitudes = df['latitud'].to_numpy(dtype=np.float64)
+    longitudes = df['longitud'].to_numpy(dtype=np.float64)
+
+    celdas = pd.DataFrame({
+        'celda_lat': np.floor(latitudes / tamano_celda).astype(np.int64),
+        'celda_lon': np.floor(longitudes / tamano_celda).astype(np.int64),
+        'latitud': latitudes,
+        'longitud': longitudes,
+        'estado': df['estado'].to_numpy()
+    })
+
+    claves = ['celda_lat', 'celda_lon']
+    df_celdas = celdas.groupby(claves).agg(latitud=('latitud', 'mean'), longitud=('longitud', 'mean'), total=('estado', 'size'))
+    conteos = pd.crosstab([celdas['celda_lat'], celdas['celda_lon']], celdas['estado']).reindex(columns=ESTADOS, fill_value=0)
+    df_celdas = df_celdas.join(conteos).reset_index(drop=True)
+
+    gravedad = df_celdas[ESTADOS].to_numpy() > 0
+    df_celdas['estado'] = np.array(ESTADOS)[gravedad.argmax(axis=1)]
+    return df_celdas
+
+CACHE_TTL_SEGUNDOS = int(os.getenv("CACHE_TTL_SEGUNDOS", "60"))
+# Los trabajadores de Dataflow escriben en paralelo y los streaming inserts llegan con retraso, así que cada refresco
+# vuelve a leer este margen por detrás del watermark
+SOLAPE_WATERMARK = pd.Timedelta(seconds=int(os.getenv("SOLAPE_WATERMARK_SEGUNDOS", "300")))
+
+_cache = {"df": None, "conteos": Counter(), "conteos_ventana": Counter(), "watermark": None, "total_menores": 0, "actualizado": 0.0}
+_cache_lock = threading.Lock()
+
+def _cache_vigente():
+    return _cache["df"] is not None and (time.monotonic() - _cache["actualizado"]) < CACHE_TTL_SEGUNDOS
+
+def descartar_ya_cargadas(df_nuevas, df):
+    """Quita de df_nuevas las filas cuyo (id_menor, fecha) ya está en df, y los duplicados entre ellas."""
+    claves = ['id_menor', 'fecha']
+    df_nuevas = df_nuevas.drop_duplicates(subset=claves)
+    if df_nuevas.empty:
+        return df_nuevas
+
+    # Solo pueden repetirse las filas cargadas dentro del solape
+    cargadas = pd.MultiIndex.from_frame(df.loc[df['fecha'] >= df_nuevas['fecha'].min(), claves])
+    return df_nuevas[~pd.MultiIndex.from_frame(df_nuevas[claves]).isin(cargadas)]
+
+def _refrescar_ventana():
+    """Añade a la ventana de 24 horas las filas nuevas desde el watermark (menos el solape) y descarta las caducadas.
+
+    Los conteos del gráfico de tarta y del top 5 se leen de la vista materializada alertas_por_menor_hora;
+    si no está disponible se mantienen incrementalmente sumando el delta y restando lo expulsado.
+    Se crean objetos nuevos en lugar de mutar los actuales para que los callbacks en curso no los vean cambiar.
+    """
+    if _cache["df"] is None or _cache["watermark"] is None:
+        df, total_menores = get_data()
+        conteos = contar_estados(df)
+    else:
+        df_nuevas, total_menores = get_data(_cache["watermark"] - SOLAPE_WATERMARK)
+        df_nuevas = descartar_ya_cargadas(df_nuevas, _cache["df"])
+        # concat pierde el tipo categórico si las categorías difieren, así que se vuelve a tipar
+        df = tipar_notificaciones(pd.concat([df_nuevas, _cache["df"]], ignore_index=True)) if not df_nuevas.empty else _cache["df"]
+        conteos = Counter(_cache["conteos_ventana"])
+        conteos.update(contar_estados(df_nuevas))
+
+    limite = inicio_ventana()
+    caducadas = df['fecha'] < limite
+    if caducadas.any():
+        conteos.subtract(contar_estados(df[caducadas]))
+        conteos = +conteos
+        df = df[~caducadas].reset_index(drop=True)
+
+    conteos_agregados = get_conteos()
+
+    _cache["df"] = df
+    _cache["conteos_ventana"] = conteos
+    _cache["conteos"] = conteos_agregados if conteos_agregados is not None else conteos
+    _cache["watermark"] = df['fecha'].max() if not df.empty else None
+    _cache["total_menores"] = total_menores
+
+def get_cached_data():
+    """Devuelve los datos compartidos por todo el proceso, refrescándolos en BigQuery como máximo una vez por TTL.
+
+    Solo un hilo ejecuta la consulta cuando el cache caduca; el resto espera al lock y reutiliza su resultado.
+    """
+    if _cache_vigente():
+        return _cache["df"], _cache["conteos"], _cache["total_menores"]
+
+    with _cache_lock:
+        if not _cache_vigente():
+            _refrescar_ventana()
+            _cache["actualizado"] = time.monotonic()
+
+        return _cache["df"], _cache["conteos"], _cache["total_menores"]
+
 style_container = {
     'font-family': '"Segoe UI", Roboto, Helvetica, Arial, sans-serif',
     'padding': '20px',
@@ -56,7 +221,9 @@ style_container = {
 
 app.layout = html.Div(style=style_container, children=[
     html.H1("Dashboard de Administración - Monitoreo de Menores", 
-            style={'text-align': 'center', 'color': '#333', 'margin-bottom': '30px'}),
+            style={'text-align': 'center', 'color': '#333', 'margin-bottom': '10px'}),
+    html.P("Últimas 24 horas completas y la hora en curso.",
+           style={'text-align': 'center', 'color': '#777', 'margin-bottom': '30px'}),
     
     html.Div(style={'display': 'flex', 'flex-wrap': 'wrap', 'gap': '20px', 'margin-bottom': '30px'}, children=[
         html.Div(style={'flex': '1', 'min-width': '400px', 'background': 'white', 'padding': '15px', 'border-radius': '8px', 'box-shadow': '0 2px 4px rgba(0,0,0,0.1)'}, children=[
@@ -91,7 +258,8 @@ app.layout = html.Div(style=style_container, children=[
      Input('dropdown-menor', 'value')]
 )
 def update_dashboard(n, selected_menor):
-    df, total_menores = get_data()
+    # El cambio de menor en el desplegable filtra en memoria sobre el DataFrame cacheado
+    df, conteos, total_menores = get_cached_data()
     
     fig_estados = px.pie(title="Sin datos")
     fig_mapa = px.scatter_mapbox(lat=[], lon=[], zoom=1)
@@ -101,26 +269,41 @@ def update_dashboard(n, selected_menor):
 
     if not df.empty:
         options = [{'label': i, 'value': i} for i in df['nombre_menor'].unique()]
+
+        # Los gráficos de conteo salen de los agregados mantenidos incrementalmente, no de las filas
+        df_conteos = pd.DataFrame(
+            [(nombre, estado, cantidad) for (nombre, estado), cantidad in conteos.items()],
+            columns=['nombre_menor', 'estado', 'cantidad']
+        )
         
-        df_alerts = df[df['estado'].isin(['PELIGRO', 'ADVERTENCIA'])]
+        df_alerts = df_conteos[df_conteos['estado'].isin(['PELIGRO', 'ADVERTENCIA'])]
         if not df_alerts.empty:
-            top5 = df_alerts['nombre_menor'].value_counts().head(5).reset_index()
-            top5.columns = ['nombre_menor', 'cantidad']
+            top5 = df_alerts.groupby('nombre_menor', as_index=False)['cantidad'].sum().nlargest(5, 'cantidad')
             fig_top5 = px.bar(top5, x='nombre_menor', y='cantidad', 
                               color='cantidad', color_continuous_scale='Reds')
         
         if selected_menor:
             df = df[df['nombre_menor'] == selected_menor]
+            df_conteos = df_conteos[df_conteos['nombre_menor'] == selected_menor]
 
-        fig_estados = px.pie(df, names='estado', hole=0.4,
+        df_estados = df_conteos.groupby('estado', as_index=False)['cantidad'].sum()
+        fig_estados = px.pie(df_estados, names='estado', values='cantidad', hole=0.4,
                              color='estado',
                              color_discrete_map={'PELIGRO': '#c0392b', 'ADVERTENCIA': '#f39c12', 'OK': '#27ae60'})
         fig_estados.update_layout(margin=dict(t=0, b=0, l=0, r=0))
 
-        fig_mapa = px.scatter_mapbox(df, lat="latitud", lon="longitud", color="estado",
-                                     hover_name="nombre_menor", hover_data=["fecha", "estado"],
-                                     color_discrete_map={'PELIGRO': '#c0392b', 'ADVERTENCIA': '#f39c12', 'OK': '#27ae60'},
-                                     zoom=5)
+        # Con un menor seleccionado o pocos puntos se dibujan las posiciones reales; si no, una por celda
+        if selected_menor or len(df) <= MAX_PUNTOS_MAPA:
+            fig_mapa = px.scatter_mapbox(df, lat="latitud", lon="longitud", color="estado",
+                                         hover_name="nombre_menor", hover_data=["fecha", "estado"],
+                                         color_discrete_map={'PELIGRO': '#c0392b', 'ADVERTENCIA': '#f39c12', 'OK': '#27ae60'},
+                                         zoom=5)
+        else:
+            df_celdas = agrupar_en_celdas(df)
+            fig_mapa = px.scatter_mapbox(df_celdas, lat="latitud", lon="longitud", color="estado",
+                                         size="total", hover_data=["total"] + ESTADOS,
+                                         color_discrete_map={'PELIGRO': '#c0392b', 'ADVERTENCIA': '#f39c12', 'OK': '#27ae60'},
+                                         zoom=5)
         fig_mapa.update_layout(mapbox_style="carto-positron")
         fig_mapa.update_layout(margin={"r":0,"t":0,"l":0,"b":0})
 
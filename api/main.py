@@ -9,6 +9,7 @@ from uuid import UUID, uuid4
 import os
 import json
 import logging
+import time
 
 proyecto_region_instancia = os.getenv("PROYECTO_REGION_INSTANCIA")
 usuario_db = os.getenv("USUARIO_DB")
@@ -84,6 +85,33 @@ class Ubicaciones(BaseModel):
     latitud: float
     longitud: float
 
+class LoteUbicaciones(BaseModel):
+    ubicaciones: list[Ubicaciones]
+
+class LoteMenores(BaseModel):
+    menores: list[Menores]
+
+class LoteAdultos(BaseModel):
+    adultos: list[Adultos]
+
+class LoteZonasRestringidas(BaseModel):
+    zonas_restringidas: list[ZonasRestringidas]
+
+consulta_insertar_menor = text("""
+    INSERT INTO menores (id, id_adulto, nombre, apellidos, dni, fecha_nacimiento, direccion, url_foto, discapacidad)
+    VALUES (:id, :id_adulto, :nombre, :apellidos, :dni, :fecha_nacimiento, :direccion, :url_foto, :discapacidad)
+""")
+
+consulta_insertar_adulto = text("""
+    INSERT INTO adultos (id, nombre, apellidos, telefono, email, ciudad, clave)
+    VALUES (:id, :nombre, :apellidos, :telefono, :email, :ciudad, :clave)
+""")
+
+consulta_insertar_zona = text("""
+    INSERT INTO zonas_restringidas (id, id_menor, nombre, latitud, longitud, radio_peligro, radio_advertencia)
+    VALUES (:id, :id_menor, :nombre, :latitud, :longitud, :radio_peligro, :radio_advertencia)
+""")
+
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=True)
 
 async def get_api_key(api_key_header: str = Security(api_key_header)):
@@ -153,6 +181,11 @@ def crear_tablas():
                 estado VARCHAR(20)
             );
         """))
+        logger.info("Creando índice de paginación del histórico si no existe...")
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_historico_menor_fecha
+                ON historico_notificaciones (id_menor, fecha DESC, id DESC);
+        """))
         logger.info("Configurando usuario de replicación y permisos...")
         try:
             conn.execute(text(f'ALTER USER "{usuario_db}" WITH REPLICATION;'))
@@ -188,18 +221,24 @@ def obtener_conexion():
 @app.post("/menores", status_code = 201)
 async def crear_menor(menor: Menores, db = Depends(obtener_conexion)):
     try:
-        consulta = text("""
-            INSERT INTO menores (id, id_adulto, nombre, apellidos, dni, fecha_nacimiento, direccion, url_foto, discapacidad)
-            VALUES (:id, :id_adulto, :nombre, :apellidos, :dni, :fecha_nacimiento, :direccion, :url_foto, :discapacidad)
-        """)
-
-        db.execute(consulta, menor.model_dump())
+        db.execute(consulta_insertar_menor, menor.model_dump())
 
         return {"mensaje": "Menor creado exitosamente"}
     
     except Exception as e:
         raise HTTPException(status_code = 500, detail = f"Error al insertar: {str(e)}")
 
+@app.post("/menores/lote", status_code = 201)
+async def crear_menores_lote(lote: LoteMenores, db = Depends(obtener_conexion)):
+    try:
+        # Todo el lote se inserta en una única transacción
+        db.execute(consulta_insertar_menor, [menor.model_dump() for menor in lote.menores])
+
+        return {"mensaje": f"Menores creados: {len(lote.menores)}"}
+    
+    except Exception as e:
+        raise HTTPException(status_code = 500, detail = f"Error al insertar: {str(e)}")
+
 @app.post("/fotos_menores", status_code = 201)
 async def crear_fotos_menores(id_menor: UUID, archivo: UploadFile = File(...)):
     try:
@@ -231,41 +270,69 @@ async def obtener_ids_menores(db = Depends(obtener_conexion)):
 @app.post("/adultos", status_code = 201)
 async def crear_adulto(adulto: Adultos, db = Depends(obtener_conexion)):
     try:
-        consulta = text("""
-            INSERT INTO adultos (id, nombre, apellidos, telefono, email, ciudad, clave)
-            VALUES (:id, :nombre, :apellidos, :telefono, :email, :ciudad, :clave)
-        """)
-
-        db.execute(consulta, adulto.model_dump())
+        db.execute(consulta_insertar_adulto, adulto.model_dump())
 
         return {"mensaje": "Adulto creado exitosamente"}
 
     except Exception as e:
         raise HTTPException(status_code = 500, detail = f"Error al insertar: {str(e)}")
 
+@app.post("/adultos/lote", status_code = 201)
+async def crear_adultos_lote(lote: LoteAdultos, db = Depends(obtener_conexion)):
+    try:
+        # Todo el lote se inserta en una única transacción
+        db.execute(consulta_insertar_adulto, [adulto.model_dump() for adulto in lote.adultos])
+
+        return {"mensaje": f"Adultos creados: {len(lote.adultos)}"}
+
+    except Exception as e:
+        raise HTTPException(status_code = 500, detail = f"Error al insertar: {str(e)}")
+
 @app.post("/zonas_restringidas", status_code = 201)
 async def crear_zona_restringida(zona: ZonasRestringidas, db = Depends(obtener_conexion)):
     try:
-        consulta = text("""
-            INSERT INTO zonas_restringidas (id, id_menor, nombre, latitud, longitud, radio_peligro, radio_advertencia)
-            VALUES (:id, :id_menor, :nombre, :latitud, :longitud, :radio_peligro, :radio_advertencia)
-        """)
-
-        db.execute(consulta, zona.model_dump())
+        db.execute(consulta_insertar_zona, zona.model_dump())
 
         return {"mensaje": "Zona restringida creada exitosamente"}
     except Exception as e:
         raise HTTPException(status_code = 500, detail = f"Error al insertar: {str(e)}")
+
+@app.post("/zonas_restringidas/lote", status_code = 201)
+async def crear_zonas_restringidas_lote(lote: LoteZonasRestringidas, db = Depends(obtener_conexion)):
+    try:
+        # Todo el lote se inserta en una única transacción
+        db.execute(consulta_insertar_zona, [zona.model_dump() for zona in lote.zonas_restringidas])
+
+        return {"mensaje": f"Zonas restringidas creadas: {len(lote.zonas_restringidas)}"}
+    except Exception as e:
+        raise HTTPException(status_code = 500, detail = f"Error al insertar: {str(e)}")
     
 @app.post("/ubicaciones", status_code = 201)
 async def crear_ubicaciones(ubicacion: Ubicaciones):
     try: 
-        mensaje_bytes = json.dumps(ubicacion.model_dump()).encode("utf-8")
+        # t_ingesta: instante de llegada a la API, primera etapa de la traza de latencia del pipeline
+        mensaje_bytes = json.dumps({**ubicacion.model_dump(), "t_ingesta": time.time()}).encode("utf-8")
 
         future = publisher.publish(topic_path, mensaje_bytes)
 
         mensaje_id = future.result()
 
         return {"mensaje": f"Ubicacion creada: {mensaje_id}"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al publicar en Pub/Sub: {str(e)}")
+
+@app.post("/ubicaciones/lote", status_code = 201)
+async def crear_ubicaciones_lote(lote: LoteUbicaciones):
+    try:
+        # Se publica un mensaje por ubicación; el cliente de Pub/Sub agrupa las publicaciones internamente
+        t_ingesta = time.time()
+        futures = [
+            publisher.publish(topic_path, json.dumps({**ubicacion.model_dump(), "t_ingesta": t_ingesta}).encode("utf-8"))
+            for ubicacion in lote.ubicaciones
+        ]
+
+        mensajes_ids = [future.result() for future in futures]
+
+        return {"mensaje": f"Ubicaciones creadas: {len(mensajes_ids)}"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al publicar en Pub/Sub: {str(e)}")
\ No newline at end of file
@@ -32,6 +32,9 @@ CREATE TABLE IF NOT EXISTS historico_notificaciones (
     estado VARCHAR(20)
 );
 
+CREATE INDEX IF NOT EXISTS idx_historico_menor_fecha
+    ON historico_notificaciones (id_menor, fecha DESC, id DESC);
+
 CREATE TABLE IF NOT EXISTS zonas_restringidas (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     id_menor UUID REFERENCES menores(id),
@@ -80,7 +80,8 @@ resource "google_service_account" "dashboard_cloud_run" {
 resource "google_project_iam_member" "dashboard_cloud_run_roles" {
   for_each = toset([
     "roles/bigquery.jobUser",
-    "roles/bigquery.dataViewer"
+    "roles/bigquery.dataViewer",
+    "roles/bigquery.readSessionUser"
   ])
   project = var.project_id
   role = each.key
@@ -130,6 +130,7 @@ resource "google_bigquery_table" "historico_notificaciones" {
     type  = "DAY"
     field = "fecha"
   }
+  clustering = ["id_menor"]
   schema = <<EOF
 [ 
   {"name": "id_menor", "type": "STRING"},
@@ -142,6 +143,32 @@ resource "google_bigquery_table" "historico_notificaciones" {
 EOF
 }
 
+resource "google_bigquery_table" "alertas_por_menor_hora" {
+  dataset_id = google_bigquery_dataset.monitoreo_dataset.dataset_id
+  table_id   = "alertas_por_menor_hora"
+  # Agregada por hora pero particionada por día: la partición de una vista materializada debe coincidir con la de
+  # historico_notificaciones
+  time_partitioning {
+    type  = "DAY"
+    field = "hora"
+  }
+  clustering = ["id_menor", "estado"]
+  materialized_view {
+    enable_refresh      = true
+    refresh_interval_ms = 60000
+    query = <<EOF
+SELECT
+  TIMESTAMP_TRUNC(fecha, HOUR) AS hora,
+  id_menor,
+  nombre_menor,
+  estado,
+  COUNT(*) AS cantidad
+FROM `${var.project_id}.${google_bigquery_dataset.monitoreo_dataset.dataset_id}.${google_bigquery_table.historico_notificaciones.table_id}`
+GROUP BY hora, id_menor, nombre_menor, estado
+EOF
+  }
+}
+
 resource "google_firestore_database" "database" {
   project     = var.project_id
   name        = "(default)"
@@ -25,6 +25,7 @@ variable "servicios_gcp" {
     "compute.googleapis.com",
     "storage.googleapis.com",
     "bigquery.googleapis.com",
+    "bigquerystorage.googleapis.com",
     "sqladmin.googleapis.com",
     "artifactregistry.googleapis.com",
     "run.googleapis.com",
@@ -1,12 +1,17 @@
 import streamlit as st
 import pandas as pd
 import folium
+import streamlit_folium
 from streamlit_folium import st_folium
 from google.cloud.sql.connector import Connector, IPTypes
 from sqlalchemy import create_engine, text
 import os
 from google.cloud import storage, firestore
 import uuid
+import hashlib
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 
 proyecto_region_instancia = os.getenv("PROYECTO_REGION_INSTANCIA")
 usuario_db = os.getenv("USUARIO_DB")
@@ -111,15 +116,260 @@ def obtener_ubicacion_menor(id_menor):
     except Exception:
         return None
 
-def obtener_historico_notificaciones(id_menor):
+GRAVEDAD_ALERTAS = {"PELIGRO": 2, "ADVERTENCIA": 1}
+
+def alerta_principal(alertas):
+    """La alerta más grave; entre las igual de graves, la más reciente."""
+    def clave(datos):
+        # Las notificaciones anteriores al campo estado solo lo llevan en el asunto
+        estado = datos.get("estado") or next((e for e in GRAVEDAD_ALERTAS if e in str(datos.get("asunto", ""))), None)
+        fecha = datos.get("fecha")
+        return GRAVEDAD_ALERTAS.get(estado, 0), fecha.timestamp() if fecha else 0
+    return max(alertas, key=clave)
+
+# Tramos de la traza que escribe el pipeline en cada documento, con el nombre que se muestra
+TRAMOS_LATENCIA = [
+    ("ingesta", "publicacion", "Pub/Sub"),
+    ("publicacion", "cierre_ventana", "ventana"),
+    ("cierre_ventana", "evaluacion", "evaluación"),
+    ("evaluacion", "escritura", "Firestore")
+]
+
+def describir_latencia(datos):
+    """Antigüedad del documento desde que la API recibió la ubicación, con el desglose por tramos; None si no está trazado."""
+    trazas = datos.get("trazas") or {}
+    inicio = trazas.get("ingesta") or trazas.get("publicacion")
+    if inicio is None:
+        return None
+
+    tramos = [
+        f"{nombre} {trazas[fin] - trazas[origen]:.1f} s"
+        for origen, fin, nombre in TRAMOS_LATENCIA
+        if trazas.get(origen) is not None and trazas.get(fin) is not None
+    ]
+    # Lo que pasa desde la escritura hasta ahora es la espera del refresco de la web
+    if trazas.get("escritura") is not None:
+        tramos.append(f"aviso {time.time() - trazas['escritura']:.1f} s")
+    desglose = f" ({' · '.join(tramos)})" if tramos else ""
+    return f"hace {time.time() - inicio:.1f} s{desglose}"
+
+TAMANO_PAGINA_HISTORICO = 50
+
+RANGOS_HISTORICO = {
+    "Últimas 24 horas": timedelta(hours=24),
+    "Últimos 7 días": timedelta(days=7),
+    "Últimos 30 días": timedelta(days=30),
+    "Todo": None
+}
+
+def ahora_madrid():
+    """Hora actual de Madrid sin zona, como la guarda el pipeline en la columna fecha (TIMESTAMP sin zona)."""
+    return datetime.now(ZoneInfo("Europe/Madrid")).replace(tzinfo=None)
+
+def obtener_historico_notificaciones(id_menor, desde=None, cursor=None, limite=TAMANO_PAGINA_HISTORICO, posterior_a=None):
+    """Devuelve una página del histórico ordenada por (fecha, id) descendente, empezando después de cursor.
+
+    Con posterior_a devuelve, sin límite, las notificaciones más recientes que ese (fecha, id)."""
     try:
+        filtros = ["id_menor = :id_menor"]
+        parametros = {"id_menor": id_menor}
+
+        if desde is not None:
+            filtros.append("fecha >= :desde")
+            parametros["desde"] = desde
+
+        if cursor is not None:
+            filtros.append("(fecha, id) < (:fecha_cursor, :id_cursor)")
+            parametros["fecha_cursor"], parametros["id_cursor"] = cursor
+
+        if posterior_a is not None:
+            filtros.append("(fecha, id) > (:fecha_posterior, :id_posterior)")
+            parametros["fecha_posterior"], parametros["id_posterior"] = posterior_a
+
+        limite_sql = ""
+        if posterior_a is None:
+            limite_sql = "LIMIT :limite"
+            parametros["limite"] = limite
+
         with engine.connect() as conn:
-            consulta = text("SELECT fecha, estado, latitud, longitud FROM historico_notificaciones WHERE id_menor = :id_menor ORDER BY fecha DESC")
-            df = pd.read_sql(consulta, conn, params={"id_menor": id_menor})
+            consulta = text(f"""
+                SELECT id, fecha, estado, latitud, longitud FROM historico_notificaciones
+                WHERE {" AND ".join(filtros)}
+                ORDER BY fecha DESC, id DESC
+                {limite_sql}
+            """)
+            df = pd.read_sql(consulta, conn, params=parametros)
             return df
     except Exception:
         return pd.DataFrame()
 
+def cargar_pagina_historico(historico):
+    df_pagina = obtener_historico_notificaciones(historico["id_menor"], historico["desde"], historico["cursor"])
+
+    if not df_pagina.empty:
+        ultima = df_pagina.iloc[-1]
+        historico["cursor"] = (pd.Timestamp(ultima["fecha"]).to_pydatetime(), str(ultima["id"]))
+        historico["df"] = pd.concat([historico["df"], df_pagina], ignore_index=True)
+
+    historico["hay_mas"] = len(df_pagina) == TAMANO_PAGINA_HISTORICO
+
+def cargar_novedades_historico(historico):
+    """Antepone las notificaciones llegadas después de la más reciente ya cargada."""
+    if historico["df"].empty:
+        cargar_pagina_historico(historico)
+        return
+
+    primera = historico["df"].iloc[0]
+    posterior_a = (pd.Timestamp(primera["fecha"]).to_pydatetime(), str(primera["id"]))
+    df_nuevas = obtener_historico_notificaciones(historico["id_menor"], posterior_a=posterior_a)
+
+    if not df_nuevas.empty:
+        historico["df"] = pd.concat([df_nuevas, historico["df"]], ignore_index=True)
+
+def centro_inicial_mapa(menor, ubicacion):
+    if ubicacion:
+        return ubicacion['latitud'], ubicacion['longitud']
+
+    direccion_lower = str(menor.direccion).lower()
+    if "madrid" in direccion_lower:
+        return 40.4168, -3.7038
+    elif "barcelona" in direccion_lower:
+        return 41.3851, 2.1734
+    return 39.4699, -0.3763
+
+def huella_zonas(zonas):
+    """Identifica el conjunto de zonas dibujadas: cambia si se añade, quita, mueve o redimensiona alguna."""
+    return hashlib.md5(repr(sorted(
+        (str(zona.id), zona.nombre, float(zona.latitud), float(zona.longitud), float(zona.radio_peligro), float(zona.radio_advertencia))
+        for zona in zonas
+    )).encode("utf-8")).hexdigest()
+
+def obtener_mapa_base(menor, capa_mapa, zonas, ubicacion):
+    """Devuelve el mapa estático (teselas y zonas) del menor ya serializado, construyéndolo solo la primera vez para cada versión de sus zonas."""
+    mapas_base = st.session_state.setdefault("mapas_base", {})
+    clave = (str(menor.id), capa_mapa, huella_zonas(zonas))
+
+    if clave in mapas_base:
+        return mapas_base[clave]
+
+    lat_map, lon_map = centro_inicial_mapa(menor, ubicacion)
+    m = folium.Map(location=[lat_map, lon_map], zoom_start=12, tiles=None)
+
+    if capa_mapa == "Callejero":
+        folium.TileLayer("OpenStreetMap", name="Callejero").add_to(m)
+    elif capa_mapa == "Satélite":
+        folium.TileLayer(
+            tiles='https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
+            attr='Esri',
+            name='Satélite'
+        ).add_to(m)
+    elif capa_mapa == "Oscuro":
+        folium.TileLayer(
+            tiles='cartodbdark_matter',
+            attr='CartoDB',
+            name='Modo Oscuro'
+        ).add_to(m)
+
+    for zona in zonas:
+        folium.Circle(
+            location=[zona.latitud, zona.longitud],
+            radius=zona.radio_advertencia,
+            color="yellow",
+            fill=True,
+            fill_opacity=0.2,
+            popup=f"Advertencia: {zona.nombre}"
+        ).add_to(m)
+        
+        folium.Circle(
+            location=[zona.latitud, zona.longitud],
+            radius=zona.radio_peligro,
+            color="red",
+            fill=True,
+            fill_opacity=0.4,
+            popup=f"Peligro: {zona.nombre}"
+        ).add_to(m)
+
+    # Solo se guardan los mapas del menor seleccionado con sus zonas actuales para no acumular mapas en la sesión
+    for clave_antigua in [c for c in mapas_base if c[0] != clave[0] or c[2] != clave[2]]:
+        del mapas_base[clave_antigua]
+    mapas_base[clave] = renderizar_mapa_base(m, clave)
+    return mapas_base[clave]
+
+def renderizar_mapa_base(m, clave):
+    """Serializa una sola vez el mapa base con los mismos pasos que st_folium (streamlit-folium 0.26.1, fijado en requirements.txt)."""
+    m.render()
+    html = streamlit_folium._get_html(m)
+    header = streamlit_folium._get_header(m)
+    script = streamlit_folium._get_map_string(m)
+
+    css_links, js_links = [], []
+    pendientes = [m]
+    while pendientes:
+        elemento = pendientes.pop(0)
+        css_links.extend(href for _, href in getattr(elemento, "default_css", []))
+        js_links.extend(src for _, src in getattr(elemento, "default_js", []))
+        pendientes.extend(getattr(elemento, "_children", {}).values())
+
+    return {
+        "mapa": m,
+        "script": script,
+        "header": header,
+        "html": html,
+        "id": streamlit_folium.get_full_id(m),
+        "css_links": list(dict.fromkeys(css_links)),
+        "js_links": list(dict.fromkeys(js_links)),
+        "key": streamlit_folium.generate_js_hash(script, f"mapa_{'_'.join(clave)}", False),
+    }
+
+def mostrar_mapa_base(base, capa_posicion, height):
+    """Dibuja el mapa base ya serializado añadiendo solo la capa con el marcador."""
+    m = base["mapa"]
+    capa_js = streamlit_folium._get_feature_group_string(capa_posicion, map=m, idx=0)
+    # La capa se quita del mapa cacheado para que no acabe en el script del siguiente tick
+    m._children.pop(capa_posicion.get_name(), None)
+
+    return streamlit_folium._component_func(
+        script=base["script"],
+        header=base["header"],
+        html=base["html"],
+        id=base["id"],
+        key=base["key"],
+        height=height,
+        width=None,
+        returned_objects=[],
+        default={},
+        zoom=None,
+        center=None,
+        feature_group=capa_js,
+        return_on_hover=False,
+        layer_control=None,
+        pixelated=False,
+        css_links=base["css_links"],
+        js_links=base["js_links"],
+        on_change=None,
+        wrap_longitude=False,
+    )
+
+def crear_capa_posicion(ubicacion):
+    """Capa dinámica con el marcador de la ubicación actual, lo único que cambia en cada tick."""
+    capa = folium.FeatureGroup(name="Ubicación Actual")
+
+    if ubicacion:
+        estado = ubicacion.get('estado', 'OK')
+        color_marcador = "green"
+        if estado == "PELIGRO":
+            color_marcador = "red"
+        elif estado == "ADVERTENCIA":
+            color_marcador = "orange"
+        
+        folium.Marker(
+            location=[ubicacion['latitud'], ubicacion['longitud']],
+            popup=f"Ubicación Actual ({estado})",
+            icon=folium.Icon(color=color_marcador, icon="user")
+        ).add_to(capa)
+
+    return capa
+
 if not st.session_state.logged_in:
     col1, col2, col3 = st.columns([1, 2, 1])
 
@@ -192,6 +442,9 @@ else:
             ids_menores = [str(m.id) for m in menores_usuario]
             
             if ids_menores:
+                alertas_por_menor = {}
+                refs_leidas = []
+
                 for i in range(0, len(ids_menores), 10):
                     chunk = ids_menores[i:i+10]
                     docs = db_firestore.collection("notificaciones")\
@@ -201,8 +454,25 @@ else:
                     
                     for doc in docs:
                         data = doc.to_dict()
-                        st.toast(f"{data.get('asunto')}: {data.get('cuerpo')}", icon="🚨")
-                        db_firestore.collection("notificaciones").document(doc.id).update({"leido": True})
+                        alertas_por_menor.setdefault(data.get("id_menor"), []).append(data)
+                        refs_leidas.append(doc.reference)
+
+                for alertas in alertas_por_menor.values():
+                    # El stream no tiene orden; se muestra la más grave para que un PELIGRO no quede tapado
+                    ultima = alerta_principal(alertas)
+                    latencia = describir_latencia(ultima)
+                    antiguedad = f" — {latencia}" if latencia else ""
+                    if len(alertas) == 1:
+                        st.toast(f"{ultima.get('asunto')}: {ultima.get('cuerpo')}{antiguedad}", icon="🚨")
+                    else:
+                        st.toast(f"{ultima.get('asunto')}: {ultima.get('cuerpo')} (+{len(alertas) - 1} alertas más de {ultima.get('nombre_menor', 'este menor')}){antiguedad}", icon="🚨")
+
+                # Firestore admite como máximo 500 escrituras por lote
+                for i in range(0, len(refs_leidas), 500):
+                    lote = db_firestore.batch()
+                    for ref in refs_leidas[i:i+500]:
+                        lote.update(ref, {"leido": True})
+                    lote.commit()
         except Exception:
             pass
 
@@ -297,95 +567,55 @@ else:
 
         with tab_mapa:
             st.subheader("Mapa")
-            zonas = obtener_zonas_restringidas(menor.id)
-            
             @st.fragment(run_every=5)
             def mostrar_mapa():
                 capa_mapa = st.radio("Capa del mapa", ["Callejero", "Satélite", "Oscuro"], horizontal=True)
                 ubicacion = obtener_ubicacion_menor(menor.id)
-                
-                lat_map, lon_map = 39.4699, -0.3763 
-                zoom_map = 12
-                
-                map_key = f"mapa_{menor.id}"
-                map_state = st.session_state.get(map_key)
-                
-                if map_state and map_state.get("center"):
-                    lat_map = map_state["center"]["lat"]
-                    lon_map = map_state["center"]["lng"]
-                    zoom_map = map_state["zoom"]
-                elif ubicacion:
-                    lat_map, lon_map = ubicacion['latitud'], ubicacion['longitud']
-                else:
-                    direccion_lower = str(menor.direccion).lower()
-                    
-                    if "madrid" in direccion_lower:
-                        lat_map, lon_map = 40.4168, -3.7038
-                    elif "barcelona" in direccion_lower:
-                        lat_map, lon_map = 41.3851, 2.1734
-                    
-                m = folium.Map(location=[lat_map, lon_map], zoom_start=zoom_map, tiles=None)
-                
-                if capa_mapa == "Callejero":
-                    folium.TileLayer("OpenStreetMap", name="Callejero").add_to(m)
-                elif capa_mapa == "Satélite":
-                    folium.TileLayer(
-                        tiles='https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}',
-                        attr='Esri',
-                        name='Satélite'
-                    ).add_to(m)
-                elif capa_mapa == "Oscuro":
-                    folium.TileLayer(
-                        tiles='cartodbdark_matter',
-                        attr='CartoDB',
-                        name='Modo Oscuro'
-                    ).add_to(m)
-
-                if ubicacion:
-                    estado = ubicacion.get('estado', 'OK')
-                    color_marcador = "green"
-                    if estado == "PELIGRO":
-                        color_marcador = "red"
-                    elif estado == "ADVERTENCIA":
-                        color_marcador = "orange"
-                    
-                    folium.Marker(
-                        location=[ubicacion['latitud'], ubicacion['longitud']],
-                        popup=f"Ubicación Actual ({estado})",
-                        icon=folium.Icon(color=color_marcador, icon="user")
-                    ).add_to(m)
-
-                for zona in zonas:
-                    folium.Circle(
-                        location=[zona.latitud, zona.longitud],
-                        radius=zona.radio_advertencia,
-                        color="yellow",
-                        fill=True,
-                        fill_opacity=0.2,
-                        popup=f"Advertencia: {zona.nombre}"
-                    ).add_to(m)
-                    
-                    folium.Circle(
-                        location=[zona.latitud, zona.longitud],
-                        radius=zona.radio_peligro,
-                        color="red",
-                        fill=True,
-                        fill_opacity=0.4,
-                        popup=f"Peligro: {zona.nombre}"
-                    ).add_to(m)
-                
-                st_folium(m, use_container_width=True, height=500, key=map_key)
+                # Las zonas se consultan en cada tick para que un alta o cambio se vea sin recargar la página
+                zonas = obtener_zonas_restringidas(menor.id)
+
+                # El mapa base (teselas y zonas) solo se construye y serializa una vez por menor, capa y
+                # versión de las zonas; en cada tick solo se genera el JS de la capa con el marcador.
+                # Streamlit reenvía igualmente todos los argumentos del componente (script incluido),
+                # pero al no cambiar el script el mapa no se vuelve a montar en el navegador.
+                base = obtener_mapa_base(menor, capa_mapa, zonas, ubicacion)
+                capa_posicion = crear_capa_posicion(ubicacion)
+                mostrar_mapa_base(base, capa_posicion, height=500)
+
+                latencia = describir_latencia(ubicacion) if ubicacion else None
+                if latencia:
+                    st.caption(f"Última ubicación recibida {latencia}")
 
             mostrar_mapa()
 
         with tab_historico:
             st.subheader("Historial de Notificaciones")
-            df_notificaciones = obtener_historico_notificaciones(menor.id)
+            rango = st.selectbox("Periodo", list(RANGOS_HISTORICO.keys()), key="rango_historico")
+
+            # Las páginas ya cargadas se guardan en la sesión; en cada rerun solo se consultan las notificaciones
+            # nuevas, y las más antiguas bajo demanda
+            historico = st.session_state.get("historico")
+            if not historico or historico["id_menor"] != str(menor.id) or historico["rango"] != rango:
+                intervalo = RANGOS_HISTORICO[rango]
+                historico = {
+                    "id_menor": str(menor.id),
+                    "rango": rango,
+                    "desde": ahora_madrid() - intervalo if intervalo else None,
+                    "cursor": None,
+                    "df": pd.DataFrame(),
+                    "hay_mas": False
+                }
+                cargar_pagina_historico(historico)
+                st.session_state.historico = historico
+            else:
+                cargar_novedades_historico(historico)
+
+            df_notificaciones = historico["df"]
             
             if not df_notificaciones.empty:
                 st.write("Selecciona una notificación para ver el detalle en el mapa:")
                 event = st.dataframe(
-                    df_notificaciones, 
+                    df_notificaciones.drop(columns=["id"]), 
                     use_container_width=True,
                     on_select="rerun",
                     selection_mode="single-row",
@@ -405,5 +635,9 @@ else:
                         icon=folium.Icon(color=color, icon="info-sign")
                     ).add_to(m_hist)
                     st_folium(m_hist, height=300, use_container_width=True, key="mapa_historico")
+
+                if historico["hay_mas"] and st.button("Cargar notificaciones anteriores"):
+                    cargar_pagina_historico(historico)
+                    st.rerun()
             else:
                 st.info("No hay notificaciones registradas para este menor.")